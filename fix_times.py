@@ -119,6 +119,8 @@ def process_file(json_path: Path) -> bool:
     except Exception as exc:
         print(f"  [!] خطأ في قراءة {json_path}: {exc}")
         return False
+    if not isinstance(data, dict):
+        return False
 
     flight_name = data.get("flight", json_path.stem)
     std_etd_old = (data.get("std_etd") or "").strip()
@@ -167,10 +169,10 @@ def main() -> None:
     print(f"  UTC → MCT  (+{UTC_OFFSET} hours)")
     print(f"{'='*55}\n")
 
-    # جمع كل ملفات JSON (استثناء meta.json)
+    # جمع كل ملفات JSON (استثناء meta.json وملفات الحالة المخفية)
     json_files = sorted(
         p for p in data_dir.rglob("*.json")
-        if p.name != "meta.json" and ".bak" not in p.suffixes
+        if p.name != "meta.json" and not p.name.startswith(".") and ".bak" not in p.suffixes
     )
 
     if not json_files:
@@ -17,8 +17,12 @@ import json
 import hashlib
 import calendar as _cal
 from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
+from functools import lru_cache
+from html import escape as _html_escape
 from pathlib import Path
+from urllib.parse import urlparse
 from zoneinfo import ZoneInfo
 
 import requests
@@ -26,7 +30,23 @@ import time
 import random
 from requests.adapters import HTTPAdapter
 from urllib3.util.retry import Retry
-from bs4 import BeautifulSoup
+# "gzip,deflate" + ",br" (و zstd) فقط إذا كانت مكتبة فك الضغط مثبّتة — urllib3 يفكها تلقائياً
+from urllib3.util.request import ACCEPT_ENCODING
+
+# orjson أسرع بعدة مرات من json ويعطي نفس المخرجات مع OPT_INDENT_2 — نرجع لـ json إذا غير مثبّت
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# lxml (libxml2) أسرع بكثير من html.parser — نرجع إليه فقط إذا lxml غير مثبّت
+# bs4 يُستورد داخل الدوال التي تحتاجه فقط (الروستر + مسار الاحتياط بدون lxml)
+try:
+    from lxml import etree as _etree
+    _HTML_PARSER = "lxml"
+except ImportError:
+    _etree = None
+    _HTML_PARSER = "html.parser"
 
 
 # ══════════════════════════════════════════════════════════════════
@@ -57,7 +77,7 @@ _REALISTIC_HEADERS = {
     ),
     "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,*/*;q=0.8",
     "Accept-Language": "en-US,en;q=0.9,ar;q=0.8",
-    "Accept-Encoding": "gzip, deflate, br",
+    "Accept-Encoding": ACCEPT_ENCODING,
     "DNT": "1",
     "Connection": "keep-alive",
     "Upgrade-Insecure-Requests": "1",
@@ -74,7 +94,6 @@ _MIN_DELAY_SECONDS = 3.0  # الحد الأدنى بين طلبين لنفس ا
 
 def _rate_limited_get(url: str, **kwargs) -> requests.Response:
     """GET مع rate limiting تلقائي حسب الدومين — يستخدم الـ Session المشتركة."""
-    from urllib.parse import urlparse
     domain = urlparse(url).netloc
     now_ts = time.time()
     last = _last_request_time.get(domain, 0)
@@ -82,11 +101,7 @@ def _rate_limited_get(url: str, **kwargs) -> requests.Response:
     if wait > 0:
         time.sleep(wait)
 
-    # دمج الheaders
-    headers = dict(_REALISTIC_HEADERS)
-    headers.update(kwargs.pop("headers", {}))
-    kwargs["headers"] = headers
-
+    # headers المتصفح مضبوطة على الـ Session نفسها — requests يدمج معها أي headers إضافية
     resp = _SESSION.get(url, **kwargs)
     _last_request_time[domain] = time.time()
     return resp
@@ -95,19 +110,37 @@ def _rate_limited_get(url: str, **kwargs) -> requests.Response:
 #  Session مشتركة (تُنشأ مرة واحدة فقط طوال عمر السكربت)
 # ══════════════════════════════════════════════════════════════════
 
+def _retry_adapter() -> HTTPAdapter:
+    return HTTPAdapter(max_retries=Retry(
+        total=3,
+        backoff_factor=2,
+        status_forcelist=[429, 500, 502, 503, 504],
+        allowed_methods=["GET"],
+    ))
+
+
 _SESSION = requests.Session()
 _SESSION.headers.update(_REALISTIC_HEADERS)
-_SESSION.mount("https://", HTTPAdapter(max_retries=Retry(
-    total=3,
-    backoff_factor=2,
-    status_forcelist=[429, 500, 502, 503, 504],
-    allowed_methods=["GET"],
-)))
-_SESSION.mount("http://", HTTPAdapter(max_retries=Retry(
-    total=3,
-    backoff_factor=2,
-    status_forcelist=[429, 500, 502, 503, 504],
+_SESSION.mount("https://", _retry_adapter())
+_SESSION.mount("http://", _retry_adapter())
+
+# Session ثانية بدون headers المتصفح — لتحميل ملف OneDrive والطلبات المباشرة.
+# br يُعلن عنه فقط مع brotli مثبّتة (وإلا يصل جسم لا يمكن فكه).
+_FILE_SESSION = requests.Session()
+_FILE_SESSION.headers["Accept-Encoding"] = ACCEPT_ENCODING
+_FILE_SESSION.mount("https://", _retry_adapter())
+_FILE_SESSION.mount("http://", _retry_adapter())
+
+# Session لـ AirLabs: 429 لا يُعاد (المفتاح محدود — النوم ثوانٍ لكل رحلة لا يفيد)،
+# وبدون raise_on_status يصل الرد نفسه بدل RetryError فيعالجه raise_for_status كالمعتاد
+_AIRLABS_SESSION = requests.Session()
+_AIRLABS_SESSION.headers["Accept-Encoding"] = ACCEPT_ENCODING
+_AIRLABS_SESSION.mount("https://", HTTPAdapter(max_retries=Retry(
+    total=2,
+    backoff_factor=0.5,
+    status_forcelist=[500, 502, 503, 504],
     allowed_methods=["GET"],
+    raise_on_status=False,
 )))
 
 
@@ -138,7 +171,7 @@ def _load_local_db() -> dict[str, dict]:
         return _local_db
 
     try:
-        raw = json.loads(LOCAL_DB_PATH.read_text(encoding="utf-8"))
+        raw = read_json(LOCAL_DB_PATH)
         # نوحّد المفاتيح: إزالة المسافات + أحرف كبيرة
         _local_db = {
             normalize_flight_number(k): v
@@ -153,6 +186,12 @@ def _load_local_db() -> dict[str, dict]:
     return _local_db
 
 
+@lru_cache(maxsize=1)
+def _local_flights_js() -> str:
+    """mct_flights.json مُسلسلاً مرة واحدة لتضمينه في كل تقرير."""
+    return dumps_json(_load_local_db())
+
+
 def fetch_flight_info_local_db(
     flight_iata: str,
     *,
@@ -190,6 +229,9 @@ def fetch_flight_info_local_db(
 
 ONEDRIVE_URL: str = os.getenv("ONEDRIVE_FILE_URL", "")
 TIMEZONE: str     = "Asia/Muscat"
+# كائنات المنطقة الزمنية تُنشأ مرة واحدة بدل ZoneInfo(...) في كل استدعاء
+LOCAL_TZ = ZoneInfo(TIMEZONE)
+UTC_TZ   = ZoneInfo("UTC")
 
 # إذا كنت تريد إجبار بناء التقرير حتى لو الـ hash لم يتغير (مفيد للتجارب/التشخيص)
 FORCE_REBUILD: bool = os.getenv("FORCE_REBUILD", "").strip().lower() in ("1", "true", "yes", "y")
@@ -198,6 +240,7 @@ DATA_DIR:   Path = Path("data")
 STATE_FILE: Path = Path("state.txt")
 DOCS_DIR:   Path = Path("docs")
 
+
 RECIPIENTS_FILE: Path = DOCS_DIR / "data" / "email_recipients.json"
 
 def ensure_email_recipients_file() -> None:
@@ -226,11 +269,15 @@ MANPOWER_JSON_PATH: Path = Path(os.getenv("MANPOWER_JSON_PATH", "manpower.json")
 #  الدوال المساعدة
 # ══════════════════════════════════════════════════════════════════
 
-def download_file() -> tuple[str, str]:
-    """Download the OneDrive file and return (html_text, last_modified_local_str).
+def download_file() -> tuple[str | bytes, str, str]:
+    """Download the OneDrive file and return (html, last_modified_local_str, sha256).
+
+    html is the raw body (bytes) when the response declares no charset,
+    otherwise the text decoded by requests (see _response_html).
 
     last_modified_local_str is HH:MM in TIMEZONE, derived from the HTTP
     Last-Modified header.  Falls back to '' if the header is missing.
+    sha256 is computed over the raw response bytes.
     """
     url = ONEDRIVE_URL.strip()
     separator = "&" if "?" in url else "?"
@@ -241,15 +288,13 @@ def download_file() -> tuple[str, str]:
     # لذلك نضيف باراميتر متغير + Headers لمنع الكاش.
     url += f"&__ts={int(datetime.now().timestamp())}"
 
-    response = requests.get(
-        url,
-        timeout=30,
-        headers={
-            "Cache-Control": "no-cache, no-store, must-revalidate",
-            "Pragma": "no-cache",
-            "Expires": "0",
-        },
-    )
+    headers = {
+        "Cache-Control": "no-cache, no-store, must-revalidate",
+        "Pragma": "no-cache",
+        "Expires": "0",
+    }
+
+    response = _FILE_SESSION.get(url, timeout=30, headers=headers)
     response.raise_for_status()
 
     # استخراج وقت آخر تعديل للملف (يقارب وقت إرسال/استلام الإيميل)
@@ -259,19 +304,57 @@ def download_file() -> tuple[str, str]:
         try:
             from email.utils import parsedate_to_datetime
             lm_dt_utc = parsedate_to_datetime(lm_header)
-            lm_local  = lm_dt_utc.astimezone(ZoneInfo(TIMEZONE))
+            lm_local  = lm_dt_utc.astimezone(LOCAL_TZ)
             lm_str    = lm_local.strftime("%H:%M")
             print(f"  [OneDrive] Last-Modified: {lm_header} → local: {lm_str}")
         except Exception as exc:
             print(f"  [OneDrive] Failed to parse Last-Modified: {exc}")
 
-    return response.text, lm_str
+    # الـ hash على البايتات كما وصلت — بدون ترميز النص كاملاً مرة ثانية
+    return _response_html(response), lm_str, hashlib.sha256(response.content).hexdigest()
+
+
+def _mark_processed(new_hash: str) -> None:
+    """سجّل أن هذه النسخة من الملف عولجت (hash في state.txt)."""
+    # مسار "لا تغيير" يمرّ هنا في كل تشغيل — لا نعيد كتابة نفس المحتوى
+    write_text_if_changed(STATE_FILE, new_hash)
 
 
 def compute_sha256(content: str) -> str:
     return hashlib.sha256(content.encode("utf-8", errors="ignore")).hexdigest()
 
 
+# ── Regex مشتركة مُجمَّعة مرة واحدة (slugify / أرقام الرحلات / مجلدات التواريخ / النصوص) ──
+_WS_RE             = re.compile(r"\s+")
+_SLUG_BAD_CHARS_RE = re.compile(r"[^A-Za-z0-9_-]")
+_DATE_DIR_RE       = re.compile(r"\d{4}-\d{2}-\d{2}")
+# أسماء الموظفين بصيغة "الاسم - الرقم" (تُطبَّق على كل سطر/موظف)
+_IMPORT_EMP_LINE_RE = re.compile(r"^(.+?)\s*[·•\-–]\s*(\d{3,6})\b.*$")
+_ROSTER_NAME_SN_RE  = re.compile(r"^(.+?)\s*[-–]\s*(\d+)(?:\s*\(.*?\))?\s*$")
+_EMP_NAME_SN_RE     = re.compile(r"^(.+?)\s*-\s*(\d{4,})\s*(?:\((.+?)\))?$")
+_DEPT_ID_BAD_RE     = re.compile(r"[^a-z0-9]")
+_EMP_ID_DIGITS_RE   = re.compile(r"(\d{3,10})")
+
+# ── تواريخ وأوقات الرحلات (normalize_flight_date / _format_full_date / أوقات STD/ETD) ──
+_ISO_DATE_RE       = re.compile(r"\d{4}-\d{2}-\d{2}")
+_NON_ALNUM_UP_RE   = re.compile(r"[^A-Z0-9]")
+# يوم + شهر + سنة اختيارية (4 أو 2 أرقام) على النص المضغوط — نمط واحد بدل ستة.
+# صيغ المسافات (27 FEB 26) تصير نفس الشكل بعد حذف الفواصل فلا تحتاج نمطاً خاصاً.
+_FLIGHT_DATE_RE    = re.compile(r"(\d{1,2})([A-Z]{3})(\d{4}|\d{2})?")
+_MONTHS = {
+    "JAN": 1, "FEB": 2, "MAR": 3, "APR": 4, "MAY": 5, "JUN": 6,
+    "JUL": 7, "AUG": 8, "SEP": 9, "OCT": 10, "NOV": 11, "DEC": 12,
+}
+_ISO_DATE_PREFIX_RE = re.compile(r"(\d{4})-(\d{1,2})-(\d{1,2})")
+_SHORT_DATE_RE      = re.compile(r"(\d{1,2})-?([A-Z]{3})$")
+_ANY_DAY_MON_RE     = re.compile(r"(\d{1,2})\s*-?\s*([A-Z]{3})\s*-?\s*(\d{2,4})?")
+_HHMM_RE            = re.compile(r"(\d{2}:\d{2})")
+_HHMM_WORD_RE       = re.compile(r"\b(\d{2}:\d{2})\b")
+_H_MM_WORD_RE       = re.compile(r"\b(\d{1,2}:\d{2})\b")
+_H_MM_EXACT_RE      = re.compile(r"^(\d{1,2}):(\d{2})$")
+_HHMM_DIGITS_RE     = re.compile(r"\b(\d{3,4})\b")
+
+
 def normalize_flight_date(date_str: str, now: datetime) -> str:
     """Convert common email-style dates into 'YYYY-MM-DD'.
 
@@ -279,58 +362,38 @@ def normalize_flight_date(date_str: str, now: datetime) -> str:
       27FEB, 27FEB26, 27 FEB, 27-FEB, 27.FEB, 27-FEB-26, 27 FEB 2026, 2026-02-27
     Returns '' if parsing fails.
     """
+    # النتيجة تعتمد على تاريخ اليوم فقط (لا الوقت) — نفس التاريخ يتكرر لكل رحلة/تقرير
+    return _normalize_flight_date(date_str, now.date())
+
+
+@lru_cache(maxsize=1024)
+def _normalize_flight_date(date_str: str, today) -> str:
     s = (date_str or "").strip().upper()
     if not s:
         return ""
 
-    if re.fullmatch(r"\d{4}-\d{2}-\d{2}", s):
+    if _ISO_DATE_RE.fullmatch(s):
         return s
 
-    compact = re.sub(r"[^A-Z0-9]", "", s)
-    spaced = s.replace("/", " ").replace("-", " ").replace(".", " ")
-    spaced = re.sub(r"\s+", " ", spaced).strip()
-
-    months = {
-        "JAN": 1, "FEB": 2, "MAR": 3, "APR": 4, "MAY": 5, "JUN": 6,
-        "JUL": 7, "AUG": 8, "SEP": 9, "OCT": 10, "NOV": 11, "DEC": 12,
-    }
-
-    day = None
-    mon = None
-    year = None
-
-    patterns = [
-        re.fullmatch(r"(\d{1,2})([A-Z]{3})(\d{4})", compact),
-        re.fullmatch(r"(\d{1,2})([A-Z]{3})(\d{2})", compact),
-        re.fullmatch(r"(\d{1,2})([A-Z]{3})", compact),
-        re.fullmatch(r"(\d{1,2})\s*([A-Z]{3})\s*(\d{4})", spaced),
-        re.fullmatch(r"(\d{1,2})\s*([A-Z]{3})\s*(\d{2})", spaced),
-        re.fullmatch(r"(\d{1,2})\s*([A-Z]{3})", spaced),
-    ]
-
-    for m in patterns:
-        if not m:
-            continue
-        day = int(m.group(1))
-        mon = m.group(2)[:3]
-        if len(m.groups()) >= 3 and m.group(3):
-            y = m.group(3)
-            year = int(y) if len(y) == 4 else 2000 + int(y)
-        else:
-            year = now.year
-        break
-
-    if day is None or mon not in months or year is None:
+    m = _FLIGHT_DATE_RE.fullmatch(_NON_ALNUM_UP_RE.sub("", s))
+    if not m or m.group(2) not in _MONTHS:
         return ""
+    day = int(m.group(1))
+    mon = m.group(2)
+    y = m.group(3)
+    if y:
+        year = int(y) if len(y) == 4 else 2000 + int(y)
+    else:
+        year = today.year
 
     try:
-        d = datetime(year, months[mon], day).date()
+        d = datetime(year, _MONTHS[mon], day).date()
     except ValueError:
         return ""
 
-    if (d - now.date()).days > 180:
+    if (d - today).days > 180:
         try:
-            d = datetime(year - 1, months[mon], day).date()
+            d = datetime(year - 1, _MONTHS[mon], day).date()
         except ValueError:
             pass
 
@@ -339,7 +402,7 @@ def normalize_flight_date(date_str: str, now: datetime) -> str:
 
 def normalize_flight_number(flight_iata: str) -> str:
     """Normalize flight numbers like 'WY 251' -> 'WY251'."""
-    return re.sub(r"\s+", "", (flight_iata or "").strip().upper())
+    return _WS_RE.sub("", (flight_iata or "").strip().upper())
 
 
 def _time_only(val: str, tz: str = TIMEZONE) -> str:
@@ -379,7 +442,7 @@ def _time_only(val: str, tz: str = TIMEZONE) -> str:
     # NOTE: Bare HH:MM from AirLabs dep_time is already in local airport time.
     #       Only ISO datetimes with explicit UTC offset (handled above) need conversion.
     #       We do NOT blindly assume bare HH:MM is UTC — that would break dep_time fields.
-    m = re.search(r"(\d{2}:\d{2})", s)
+    m = _HHMM_RE.search(s)
     return m.group(1) if m else ""
 
 
@@ -484,7 +547,8 @@ def fetch_flight_info_airlabs(
         base_params: dict[str, str] = {"api_key": api_key, "flight_iata": flight_iata}
         base_params.update(extra_params)
         try:
-            resp = requests.get(
+            # اتصال مشترك: /schedules ثم /flights لنفس الرحلة ولكل الرحلات يعيدان استخدام TLS
+            resp = _AIRLABS_SESSION.get(
                 f"https://airlabs.co/api/v9/{endpoint}",
                 params=base_params,
                 timeout=30,
@@ -575,6 +639,13 @@ def _pick_dest_from_text(text: str, flight_iata: str) -> str:
     return ""
 
 
+# حقول صفحة Flightradar (النص بأحرف كبيرة)
+_FR24_STD_RE   = re.compile(r"STD\s*(\d{2}:\d{2})")
+_FR24_ATD_RE   = re.compile(r"ATD\s*(\d{2}:\d{2})")
+_FR24_EST_RE   = re.compile(r"ESTIMATED(?: DEPARTURE)?\s*(\d{2}:\d{2})")
+_FR24_ROUTE_RE = re.compile(r"FROM\s+([A-Z .'-]+)\s*\(([A-Z]{3})\)\s+TO\s+([A-Z .'-]+)\s*\(([A-Z]{3})\)")
+
+
 def fetch_flight_info_flightradar(
     flight_iata: str,
     *,
@@ -602,8 +673,8 @@ def fetch_flight_info_flightradar(
         print(f"  [Flightradar] request error for {flight_iata}: {exc}")
         return None
 
-    page_text = BeautifulSoup(resp.text, "html.parser").get_text(" ", strip=True)
-    page_text = re.sub(r"\s+", " ", page_text)
+    page_text = _html_page_text(_response_html(resp))
+    page_text = _WS_RE.sub(" ", page_text)
     up = page_text.upper()
 
     date_pat = ""
@@ -624,20 +695,20 @@ def fetch_flight_info_flightradar(
     atd = ""
     dest = arr_iata.strip().upper() if arr_iata else ""
 
-    m_std = re.search(r"STD\s*(\d{2}:\d{2})", segment)
+    m_std = _FR24_STD_RE.search(segment)
     if m_std:
         std = m_std.group(1)
 
-    m_atd = re.search(r"ATD\s*(\d{2}:\d{2})", segment)
+    m_atd = _FR24_ATD_RE.search(segment)
     if m_atd:
         atd = m_atd.group(1)
 
-    m_est = re.search(r"ESTIMATED(?: DEPARTURE)?\s*(\d{2}:\d{2})", segment)
+    m_est = _FR24_EST_RE.search(segment)
     if m_est:
         etd = m_est.group(1)
 
     dep_iata = (dep_iata or "").strip().upper()
-    m_route = re.search(r"FROM\s+([A-Z .'-]+)\s*\(([A-Z]{3})\)\s+TO\s+([A-Z .'-]+)\s*\(([A-Z]{3})\)", segment)
+    m_route = _FR24_ROUTE_RE.search(segment)
     if m_route:
         dep_code = m_route.group(2).strip().upper()
         arr_code = m_route.group(4).strip().upper()
@@ -689,8 +760,8 @@ def fetch_flight_info_muscatairport(
         print(f"  [MuscatAirport] request error for {flight_iata}: {exc}")
         return None
 
-    page_text = BeautifulSoup(resp.text, "html.parser").get_text(" ", strip=True)
-    page_text = re.sub(r"\s+", " ", page_text)
+    page_text = _html_page_text(_response_html(resp))
+    page_text = _WS_RE.sub(" ", page_text)
     up = page_text.upper()
 
     idx = up.find(flight_iata)
@@ -701,7 +772,7 @@ def fetch_flight_info_muscatairport(
     segment = up[max(0, idx - 120): idx + 700]
     dest = arr_iata.strip().upper() if arr_iata else ""
 
-    times = re.findall(r"\b(\d{2}:\d{2})\b", segment)
+    times = _HHMM_WORD_RE.findall(segment)
 
     # ═══ FIX: Only extract STD (first time). Do NOT guess ETD from second time.
     # Muscat Airport page has no labeled fields — assigning times blindly is dangerous.
@@ -828,6 +899,23 @@ def fetch_flight_info_with_fallbacks(
     return result
 
 
+# ── أوقات قطع الأوفلود (ساعة، دقيقة) — مشتركة بين get_shift و _shift_window_for ──
+_CUTOFF_SHIFT1 = (5, 30)    # بعد 05:30 → shift1
+_CUTOFF_SHIFT2 = (14, 30)   # بعد 14:30 → shift2
+_CUTOFF_SHIFT3 = (21, 30)   # بعد 21:30 → shift3
+_CUTOFF_SHIFT1_MINS = _CUTOFF_SHIFT1[0] * 60 + _CUTOFF_SHIFT1[1]
+_CUTOFF_SHIFT2_MINS = _CUTOFF_SHIFT2[0] * 60 + _CUTOFF_SHIFT2[1]
+_CUTOFF_SHIFT3_MINS = _CUTOFF_SHIFT3[0] * 60 + _CUTOFF_SHIFT3[1]
+
+
+def _shift_for_minutes(mins: int) -> str:
+    if _CUTOFF_SHIFT1_MINS <= mins < _CUTOFF_SHIFT2_MINS:
+        return "shift1"
+    if _CUTOFF_SHIFT2_MINS <= mins < _CUTOFF_SHIFT3_MINS:
+        return "shift2"
+    return "shift3"
+
+
 def get_shift(now: datetime) -> str:
     """تحديد المناوبة الحالية بناءً على الوقت.
 
@@ -841,13 +929,8 @@ def get_shift(now: datetime) -> str:
       بعد 21:30 → shift3
       بعد 05:30 → shift1
     """
-    mins = now.hour * 60 + now.minute
     # نستخدم أوقات القطع للأوفلود لتحديد المناوبة الفعلية
-    if 5 * 60 + 30 <= mins < 14 * 60 + 30:
-        return "shift1"
-    if 14 * 60 + 30 <= mins < 21 * 60 + 30:
-        return "shift2"
-    return "shift3"
+    return _shift_for_minutes(now.hour * 60 + now.minute)
 
 
 def get_shift_date(now: datetime, shift: str | None = None) -> str:
@@ -863,94 +946,411 @@ def get_shift_date(now: datetime, shift: str | None = None) -> str:
 
 def slugify(text: str, max_length: int = 80) -> str:
     text = (text or "UNKNOWN").strip()
-    text = re.sub(r"\s+", "_", text)
-    text = re.sub(r"[^A-Za-z0-9_-]", "_", text)
+    text = _WS_RE.sub("_", text)
+    text = _SLUG_BAD_CHARS_RE.sub("_", text)
     return (text or "UNKNOWN")[:max_length]
 
 
+def read_json(path: Path):
+    """قراءة JSON من ملف (تُطلق الاستثناء عند الخطأ — بعكس load_json)."""
+    if orjson is not None:
+        return orjson.loads(path.read_bytes())
+    return json.loads(path.read_text(encoding="utf-8"))
+
+
 def load_json(path: Path, default):
     if not path.exists():
         return default
     try:
-        return json.loads(path.read_text(encoding="utf-8"))
-    except (json.JSONDecodeError, OSError):
+        return read_json(path)
+    except (json.JSONDecodeError, OSError):  # orjson.JSONDecodeError يرث من json.JSONDecodeError
         return default
 
 
 def write_json(path: Path, data) -> None:
     path.parent.mkdir(parents=True, exist_ok=True)
+    if orjson is not None:
+        path.write_bytes(orjson.dumps(data, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS))
+        return
     path.write_text(json.dumps(data, ensure_ascii=False, indent=2), encoding="utf-8")
 
 
+def dumps_json(data) -> str:
+    """JSON مضغوط كنص (لتضمينه داخل <script>) — orjson إن وُجد."""
+    if orjson is not None:
+        return orjson.dumps(data, option=orjson.OPT_NON_STR_KEYS).decode("utf-8")
+    return json.dumps(data, ensure_ascii=False, separators=(",", ":"))
+
+
+def _write_json_many(files: dict[Path, object]) -> None:
+    """Write several independent JSON files concurrently (I/O bound)."""
+    if len(files) <= 1:
+        for path, data in files.items():
+            write_json(path, data)
+        return
+    with ThreadPoolExecutor(max_workers=min(8, len(files))) as pool:
+        # list() لإظهار أي استثناء من الخيوط
+        list(pool.map(lambda item: write_json(*item), files.items()))
+
+
+def write_text_if_changed(path: Path, text: str) -> bool:
+    """اكتب الملف فقط إذا تغيّر محتواه — الصفحات تُعاد بناؤها كل تشغيل وغالباً بنفس النتيجة."""
+    data = text.encode("utf-8")  # ترميز واحد للمقارنة والكتابة معاً
+    try:
+        # مقارنة الحجم أولاً — لا نقرأ الملف القديم إلا إذا تساوى الحجم
+        if path.stat().st_size == len(data) and path.read_bytes() == data:
+            return False
+    except OSError:
+        pass
+    path.write_bytes(data)
+    return True
+
+
+def _subdir_names(folder: Path) -> list[str]:
+    """أسماء المجلدات الفرعية مرتبة — scandir يعطي نوع العنصر بدون stat لكل مسار."""
+    try:
+        with os.scandir(folder) as it:
+            return sorted(e.name for e in it if e.is_dir())
+    except FileNotFoundError:
+        return []
+
+
+def _flight_json_files(folder: Path) -> list[Path]:
+    """ملفات الرحلات في مجلد مناوبة (بدون meta.json) مرتبة — مجلد غير موجود = []."""
+    try:
+        with os.scandir(folder) as it:
+            names = sorted(e.name for e in it if e.name.endswith(".json") and e.name != "meta.json")
+    except (FileNotFoundError, NotADirectoryError):
+        return []
+    return [folder / name for name in names]
+
+
+# ── Regex مُجمَّعة مسبقاً لمسار التحليل (تُستدعى لكل خلية/سطر) ──
+# سطر ULD/TROLLEY فقط (AKE/PMC/BT/CBT...) بدون بيانات شحنة
+_ULD_ROW_RE = re.compile(
+    r"^(CBT|BT|AKE|PMC|PAG|ULD|AKH|RKN|QKE|PKC|AAK|AKN|DQF|DQN|FQA|FQN|PGA|PLA|PLB|RKN|SAA)\w*"
+)
+# نمط العنوان: OFFLOADED CARGO ON WY237/27FEB أو OFFLOADED CARGO ON OV237/27FEB
+_TYPE_C_TITLE_RE = re.compile(
+    r"OFFLOAD(?:ED)?\s+CARGO\s+ON\s+([A-Z0-9]{2,6})\s*/\s*(\w+)",
+    re.IGNORECASE,
+)
+# نمط سطر البيانات: رقم AWB ثم PCS ثم DESC ثم CLASS ثم KGS ثم DEST
+# مثال: 703 13436275   14   SPORTS WERAS   B   194.0   SKTDUS
+_TYPE_C_DATA_RE = re.compile(
+    r"^(\d[\d\s]{5,15})\s{2,}(\d+)\s{2,}(.+?)\s{2,}([A-Z])\s{2,}([\d.]+)\s{2,}([A-Z]{3,6})\s*$"
+)
+_TYPE_C_REASON_RE = re.compile(r"CGO\s+OFFLOAD(?:ED)?\s+DUE\s+(.+)", re.IGNORECASE)
+
+# قيم تظهر مكان رقم الرحلة في صفوف العناوين وليست رحلات فعلية
+_NOT_A_FLIGHT = frozenset({"ITEM", "AWB", "PCS", ""})
+
+
 def cell_text(element) -> str:
     if element is None:
         return ""
-    text = element.get_text(" ", strip=True)
-    text = re.sub(r"\s+", " ", text).strip()
-    text = text.replace("\xa0", "").strip()
-    return text
+    # الأجزاء مقصوصة أصلاً (strip=True)، و \s+ يلتقط \xa0 أيضاً — لا حاجة لـ strip/replace إضافية
+    return _WS_RE.sub(" ", element.get_text(" ", strip=True))
 
 
 def row_texts(tr) -> list[str]:
     return [cell_text(c) for c in tr.find_all(["td", "th"])]
 
 
+# ── استخراج الجداول مباشرة من شجرة lxml (بدون بناء كائنات BeautifulSoup) ──
+if _etree is not None:
+    _LXML_PARSER = _etree.HTMLParser(encoding="utf-8")
+    # بدون ترميز مفروض: lxml يأخذه من <meta charset> / BOM داخل الصفحة
+    _LXML_META_PARSER = _etree.HTMLParser()
+    # مثل get_text في BeautifulSoup: نصوص <script>/<style>/<template> لا تُحسب
+    _TEXT_XPATH = _etree.XPath(
+        "descendant::text()[not(parent::script or parent::style or parent::template)]",
+        smart_strings=False,
+    )
+    # عناصر لا يُحسب نصها — تُحذف مرة واحدة قبل المرور على الصفوف
+    _NON_TEXT_TAGS = ("script", "style", "template")
+
+    # محددات CSS لصفحة الروستر (.deptCard / details.shiftCard / ...) كـ XPath مُجمَّع
+    def _class_xpath(cls: str, tag: str = "*", first: bool = False):
+        expr = f"descendant::{tag}[contains(concat(' ', normalize-space(@class), ' '), ' {cls} ')]"
+        return _etree.XPath(f"({expr})[1]" if first else expr)
+
+    _ROSTER_DEPT_CARDS  = _class_xpath("deptCard")
+    _ROSTER_DEPT_TITLE  = _class_xpath("deptTitle", first=True)
+    _ROSTER_SHIFT_CARDS = _class_xpath("shiftCard", tag="details")
+    _ROSTER_EMP_ROWS    = _class_xpath("empRow")
+    _ROSTER_EMP_NAME    = _class_xpath("empName", first=True)
+
+
+# charset مصرَّح به في بداية الصفحة (<meta charset=...> أو http-equiv content="...; charset=...")
+_META_CHARSET_RE = re.compile(rb"""<meta[^>]+charset\s*=\s*["']?\s*([\w.:-]+)""", re.IGNORECASE)
+_BOMS = (b"\xef\xbb\xbf", b"\xff\xfe", b"\xfe\xff")
+
+
+def _declares_non_utf8(html: bytes) -> bool:
+    """هل تصرّح البايتات نفسها بترميز غير UTF-8 (BOM أو meta في أول 1024 بايت)؟"""
+    if html.startswith(_BOMS):
+        return not html.startswith(_BOMS[0])
+    m = _META_CHARSET_RE.search(html, 0, 1024)
+    return bool(m) and m.group(1).lower() not in (b"utf-8", b"utf8")
+
+
+def _lxml_root(html: str | bytes):
+    """شجرة lxml — البايتات تُمرَّر كما هي بدون فك ثم إعادة ترميز.
+    صفحة تصرّح بترميز آخر (تصدير Outlook بـ windows-1252 مثلاً) يُقرأ ترميزها من الـ meta؛
+    غير ذلك UTF-8 مفروض، لأن libxml2 بدون meta يفترض ISO-8859-1 فيفسد العربي."""
+    if isinstance(html, bytes):
+        return _etree.fromstring(html, _LXML_META_PARSER if _declares_non_utf8(html) else _LXML_PARSER)
+    return _etree.fromstring(html.encode("utf-8"), _LXML_PARSER)
+
+
+def _response_html(response: requests.Response) -> str | bytes:
+    """جسم الرد للمحلل: نص إذا صرّح السيرفر بـ charset، وإلا البايتات الخام.
+
+    charset في Content-Type يتقدم على <meta> الصفحة، فيفكه response.text به.
+    بدونه لا نستعمل response.text: requests يفترض ISO-8859-1 لكل text/* (فيفسد
+    العربي) أو يشغّل charset_normalizer على كامل المحتوى لغير text/*. البايتات
+    تذهب لـ _lxml_root الذي يأخذ الترميز من <meta charset> / BOM الصفحة، وUTF-8
+    إن لم تصرّح بشيء — لا تُبسَّط إلى response.text."""
+    if "charset=" not in response.headers.get("Content-Type", "").lower():
+        return response.content
+    return response.text
+
+
+def _html_page_text(html: str | bytes) -> str:
+    """كل نصوص الصفحة مفصولة بمسافة — مثل get_text(" ", strip=True)."""
+    if _etree is None:
+        from bs4 import BeautifulSoup
+        return BeautifulSoup(html, _HTML_PARSER).get_text(" ", strip=True)
+    root = _lxml_root(html)
+    if root is None:
+        return ""
+    return _lxml_get_text(root)
+
+
+def _lxml_get_text(element) -> str:
+    """مثل get_text(" ", strip=True) في BeautifulSoup على عنصر lxml."""
+    return " ".join(s for s in (t.strip() for t in _TEXT_XPATH(element)) if s)
+
+
+def _lxml_cell_text(element) -> str:
+    """نفس نتيجة cell_text لكن على عنصر lxml (بعد حذف _NON_TEXT_TAGS)."""
+    # split() بدون معامل يقطع على أي مسافات ويتجاهل الفارغ — strip + دمج المسافات في خطوة واحدة
+    return " ".join(" ".join(element.itertext()).split())
+
+
+# صف العناوين في النوع A (FLIGHT/DATE/DEST) أو B (3 من 4) يحتوي 3 على الأقل من هذه
+_TABLE_MARKERS = ("ITEM", "DATE", "FLIGHT", "DEST")
+
+
+def _table_has_markers(strings) -> bool:
+    """فحص سريع قبل بناء صفوف الجدول: 3 كلمات مفتاحية على الأقل في نص الجدول.
+    النصوص تُدمج ثم upper مرة واحدة (الفاصل مسافة فلا تتكوّن كلمة عبر حدود النصوص)."""
+    up = " ".join(strings).upper()
+    return sum(kw in up for kw in _TABLE_MARKERS) >= 3
+
+
 def _get(row: list[str], idx: int | None) -> str:
     if idx is None or idx >= len(row):
         return ""
     return row[idx]
 
 
-def _find_value_after(row: list[str], keys: list[str]) -> str:
+def _pick(row: list[str], idxs: tuple[int | None, ...]) -> tuple[str, ...]:
+    """مثل _get لعدة أعمدة دفعة واحدة — يعيد tuple بنفس ترتيب idxs."""
+    n = len(row)
+    return tuple(row[i] if i is not None and i < n else "" for i in idxs)
+
+
+# مفاتيح صف عنوان النوع A: FLIGHT # | WY223 | DATE | 18.JUL | DESTINATION | COK
+_TYPE_A_HEADER_KEYS = (
+    frozenset({"FLIGHT #", "FLIGHT#", "FLIGHT"}),
+    frozenset({"DATE"}),
+    frozenset({"DESTINATION", "DEST"}),
+)
+
+
+def _find_values_after(row: list[str], key_groups: tuple[frozenset, ...]) -> list[str]:
+    """لكل مجموعة مفاتيح: القيمة في الخلية التالية لأول خلية مطابقة.
+    تمريرة واحدة على الصف وتتوقف بمجرد إيجاد كل القيم."""
+    values  = [""] * len(key_groups)
+    missing = set(range(len(key_groups)))
+    last    = len(row) - 1
     for i, cell in enumerate(row):
-        if cell.upper().strip() in [k.upper() for k in keys]:
-            if i + 1 < len(row):
-                return row[i + 1]
-    return ""
+        if i >= last:
+            break
+        key = cell.upper().strip()
+        for g in tuple(missing):
+            if key in key_groups[g]:
+                values[g] = row[i + 1]
+                missing.discard(g)
+        if not missing:
+            break
+    return values
+
 
+# أعمدة صف عناوين الشحنات في النوع A: AWB | PCS | KGS | DESCRIPTION | REASON
+_TYPE_A_CARGO_KEYS = (
+    ("AWB",),
+    ("PCS", "PIECES"),
+    ("KGS", "KG"),
+    ("DESCRIPTION", "DESC"),
+    ("REASON",),
+)
 
-def _find_index(row: list[str], keys: list[str]) -> int | None:
+
+def _find_indices(row: list[str], key_groups: tuple[tuple[str, ...], ...]) -> list[int | None]:
+    """لكل مجموعة: فهرس أول خلية تحتوي أحد مفاتيحها — تمريرة واحدة على الصف."""
+    found: list[int | None] = [None] * len(key_groups)
+    missing = len(key_groups)
     for i, cell in enumerate(row):
-        if any(k.upper() in cell.upper() for k in keys):
-            return i
-    return None
+        up = cell.upper()
+        for g, keys in enumerate(key_groups):
+            if found[g] is None and any(k in up for k in keys):
+                found[g] = i
+                missing -= 1
+        if not missing:
+            break
+    return found
 
 
 # ══════════════════════════════════════════════════════════════════
 #  تحليل HTML / النص
 # ══════════════════════════════════════════════════════════════════
 
-def extract_flights(html: str) -> list[dict]:
+# كل نوع يحتاج واحدة منها على الأقل: A/B عناوين فيها FLIGHT أو DEST، و C عنوان "OFFLOADED CARGO ON"
+_FLIGHT_PAGE_HINTS = ("FLIGHT", "DEST", "OFFLOAD")
+
+
+def _may_contain_flights(html: str | bytes) -> bool:
+    """فحص رخيص على النص الخام قبل التحليل — ملف فارغ/تالف لا يمر على lxml أصلاً."""
+    up = html.upper()
+    if isinstance(up, bytes):
+        return any(kw.encode() in up for kw in _FLIGHT_PAGE_HINTS)
+    return any(kw in up for kw in _FLIGHT_PAGE_HINTS)
+
+
+def extract_flights(html: str | bytes) -> list[dict]:
     """
     يجرّب الأنواع الثلاثة ويعيد أفضل نتيجة.
     الأولوية: A → B → C
     """
-    soup   = BeautifulSoup(html, "html.parser")
-    tables = soup.find_all("table")
+    if not _may_contain_flights(html):
+        return []
+    if _etree is not None:
+        root = _lxml_root(html)
+        if root is None:
+            return []
+        _etree.strip_elements(root, *_NON_TEXT_TAGS, with_tail=False)
+        tables    = _candidate_tables_lxml(root)
+        full_text = "\n".join(_TEXT_XPATH(root))
+    else:
+        from bs4 import BeautifulSoup
+        soup      = BeautifulSoup(html, _HTML_PARSER)
+        tables    = _candidate_tables_bs4(soup)
+        full_text = soup.get_text("\n")
 
     best: list[dict] = []
 
-    for table in tables:
-        rows = table.find_all("tr")
-        if len(rows) < 2:
-            continue
-        all_rows = [row_texts(tr) for tr in rows]
-
-        result_a = _parse_type_a(all_rows)
+    for all_rows in tables:
+        # نص كل صف بأحرف كبيرة — يُحسب مرة واحدة ويُشارك بين مصنّفات A و B
+        row_ups = [_row_upper(row) for row in all_rows]
+        result_a = _parse_type_a(all_rows, row_ups)
         if result_a:
             if len(result_a) > len(best):
                 best = result_a
             continue
 
-        result_b = _parse_type_b(all_rows)
+        result_b = _parse_type_b(all_rows, row_ups)
         if result_b and len(result_b) > len(best):
             best = result_b
 
     # النوع C: نص عادي (يُضاف فوق ما وجدناه من جداول)
-    result_c = _parse_type_c(soup)
+    result_c = _parse_type_c(full_text)
     best.extend(result_c)
 
-    return best
+    return _dedupe_flights(best)
+
+
+def _dedupe_flights(flights: list[dict]) -> list[dict]:
+    """رحلة واحدة لكل (flight, date, destination) — نفس مفتاح ملف JSON في save_flights.
+    تكرار بنفس الصيغة (كتلتان لنفس الرحلة) تُدمج شحناته، والشحنة المكررة (نفس
+    awb/item/pcs/kgs) تُحسب مرة واحدة مع أخذ الحقول الفارغة (trolley/reason...) من
+    النسخة التي فيها قيمة؛ تكرار من صيغة أخرى (نفس الرحلة في الجدول وفي النص C)
+    يُتجاهل — الأول أغنى بالحقول."""
+    by_key: dict[tuple[str, str, str], dict] = {}
+    seen_items: dict[tuple[str, str, str], dict] = {}
+    for flight in flights:
+        key = (flight["flight"], flight.get("date", ""), flight.get("destination", ""))
+        first = by_key.get(key)
+        if first is None:
+            by_key[key] = first = flight
+            seen_items[key] = {}
+            items, flight["items"] = flight["items"], []
+        elif first["format"] == flight["format"]:
+            items = flight["items"]
+        else:
+            continue
+        seen = seen_items[key]
+        for item in items:
+            sig = _item_identity(item)
+            kept = seen.get(sig)
+            if kept is None:
+                seen[sig] = item
+                first["items"].append(item)
+                continue
+            for field, value in item.items():
+                if value and not kept.get(field):
+                    kept[field] = value
+    return list(by_key.values())
+
+
+def _item_identity(item: dict) -> tuple:
+    """هوية الشحنة: awb/item مع pcs/kgs؛ صف بلا awb ولا item يُقارن بكل حقوله."""
+    if item.get("awb") or item.get("item"):
+        return (item.get("awb", ""), item.get("item", ""), item.get("pcs", ""), item.get("kgs", ""))
+    return tuple(item.items())
+
+
+def _candidate_tables_lxml(root):
+    """صفوف كل جدول (list[list[str]]) قد يكون A أو B — متداخلة كما في find_all.
+    itertext يمر على النصوص في C مباشرة بدل تقييم XPath لكل خلية."""
+    for table in root.iter("table"):
+        rows = list(table.iter("tr"))
+        if len(rows) < 2 or not _table_has_markers(table.itertext()):
+            continue
+        yield [[_lxml_cell_text(c) for c in tr.iter("td", "th")] for tr in rows]
+
+
+def _candidate_tables_bs4(soup):
+    for table in soup.find_all("table"):
+        rows = table.find_all("tr")
+        if len(rows) < 2 or not _table_has_markers(table.stripped_strings):
+            continue
+        yield [row_texts(tr) for tr in rows]
+
+
+# ── مصنّفات الصفوف المشتركة بين النوعين A و B ──
+def _row_upper(row: list[str]) -> str:
+    return " ".join(row).upper()
+
+
+def _is_type_a_header(row_up: str) -> bool:
+    # "DEST" يغطي "DESTINATION" أيضاً
+    return "FLIGHT" in row_up and "DATE" in row_up and "DEST" in row_up
+
+
+def _is_next_flight_row(row_up: str) -> bool:
+    return "FLIGHT" in row_up and "DATE" in row_up
+
+
+def _is_type_b_header(row_up: str) -> bool:
+    return sum(1 for kw in _TABLE_MARKERS if kw in row_up) >= 3
+
+
+def _is_uld_only_row(cargo_vals: tuple[str, ...]) -> bool:
+    """صف فيه ULD/TROLLEY فقط في عمود AWB (مثل AKE/PMC/BT/CBT) بدون باقي الأعمدة."""
+    return bool(_ULD_ROW_RE.match(cargo_vals[0].strip().upper())) and not any(cargo_vals[1:])
 
 
 # ────────────────────────────────────────────────────────────────
@@ -959,57 +1359,44 @@ def extract_flights(html: str) -> list[dict]:
 #  Row: AWB | PCS | KGS | DESCRIPTION | REASON
 #  Row: 910... | 35 | 781 | COURIER | SPACE
 # ────────────────────────────────────────────────────────────────
-def _parse_type_a(all_rows: list[list[str]]) -> list[dict]:
+def _parse_type_a(all_rows: list[list[str]], row_ups: list[str]) -> list[dict]:
     flights = []
     i = 0
     while i < len(all_rows):
-        row    = all_rows[i]
-        joined = " ".join(row).upper()
+        row = all_rows[i]
 
-        if ("FLIGHT" in joined and "DATE" in joined and
-                ("DESTINATION" in joined or "DEST" in joined)):
+        if _is_type_a_header(row_ups[i]):
 
-            flight_num  = _find_value_after(row, ["FLIGHT #", "FLIGHT#", "FLIGHT"])
-            date        = _find_value_after(row, ["DATE"])
-            destination = _find_value_after(row, ["DESTINATION", "DEST"])
+            flight_num, date, destination = _find_values_after(row, _TYPE_A_HEADER_KEYS)
 
             if not flight_num and not destination:
                 i += 1
                 continue
-            if flight_num.upper() in ("ITEM", "AWB", "PCS", ""):
+            if flight_num.upper() in _NOT_A_FLIGHT:
                 i += 1
                 continue
 
             cargo_header = all_rows[i + 1] if i + 1 < len(all_rows) else []
-            awb_idx  = _find_index(cargo_header, ["AWB"])
-            pcs_idx  = _find_index(cargo_header, ["PCS", "PIECES"])
-            kgs_idx  = _find_index(cargo_header, ["KGS", "KG"])
-            desc_idx = _find_index(cargo_header, ["DESCRIPTION", "DESC"])
-            rsn_idx  = _find_index(cargo_header, ["REASON"])
+            cargo_cols = tuple(_find_indices(cargo_header, _TYPE_A_CARGO_KEYS))
 
             items = []
             pending_trolley = ""
             j = i + 2
             while j < len(all_rows):
                 dr     = all_rows[j]
-                dr_str = " ".join(dr).upper()
+                dr_str = row_ups[j]
                 if "TOTAL" in dr_str:
                     j += 1
                     break
-                if "FLIGHT" in dr_str and "DATE" in dr_str:
+                if _is_next_flight_row(dr_str):
                     break
 
-                awb  = _get(dr, awb_idx)
-                pcs  = _get(dr, pcs_idx)
-                kgs  = _get(dr, kgs_idx)
-                desc = _get(dr, desc_idx)
-                rsn  = _get(dr, rsn_idx)
-
-                awb_clean = (awb or "").strip().upper()
+                vals = _pick(dr, cargo_cols)
+                awb, pcs, kgs, desc, rsn = vals
 
                 # إذا كان السطر عبارة عن ULD/TROLLEY فقط (مثل AKE/PMC/BT/CBT...)،
                 # لا نُنشئ صف شحنة جديد؛ بل نربطه بآخر شحنة سبق إضافتها.
-                if re.match(r"^(CBT|BT|AKE|PMC|PAG|ULD|AKH|RKN|QKE|PKC|AAK|AKN|DQF|DQN|FQA|FQN|PGA|PLA|PLB|RKN|SAA)\w*", awb_clean) and not any([pcs, kgs, desc, rsn]):
+                if _is_uld_only_row(vals):
                     if items:
                         items[-1]["trolley"] = awb
                     else:
@@ -1017,7 +1404,7 @@ def _parse_type_a(all_rows: list[list[str]]) -> list[dict]:
                     j += 1
                     continue
 
-                if not any([awb, pcs, kgs, desc, rsn]):
+                if not any(vals):
                     j += 1
                     continue
 
@@ -1055,13 +1442,11 @@ def _parse_type_a(all_rows: list[list[str]]) -> list[dict]:
 #  النوع B — جدول عمودي
 #  Header: ITEM | DATE | FLIGHT | STD/ETD | DEST | Email | Physical | ...
 # ────────────────────────────────────────────────────────────────
-def _parse_type_b(all_rows: list[list[str]]) -> list[dict]:
+def _parse_type_b(all_rows: list[list[str]], row_ups: list[str]) -> list[dict]:
     header_idx = None
     headers    = []
     for i, row in enumerate(all_rows):
-        joined = " ".join(row).upper()
-        hits   = sum(1 for kw in ["ITEM", "DATE", "FLIGHT", "DEST"] if kw in joined)
-        if hits >= 3:
+        if _is_type_b_header(row_ups[i]):
             header_idx = i
             headers    = [h.upper().strip() for h in row]
             break
@@ -1088,6 +1473,7 @@ def _parse_type_b(all_rows: list[list[str]]) -> list[dict]:
     c_pcs   = col(["PIECES", "VERIFICATION"])
     c_rsn   = col(["REASON"])
     c_rmk   = col(["REMARKS"])
+    item_cols = (c_item, c_pcs, c_rsn, c_email, c_phys, c_trol, c_cms, c_rmk)
 
     flights: list[dict] = []
     current: dict | None = None
@@ -1096,9 +1482,7 @@ def _parse_type_b(all_rows: list[list[str]]) -> list[dict]:
         if all(not v for v in row):
             continue
 
-        flt  = _get(row, c_flt)
-        date = _get(row, c_date)
-        dest = _get(row, c_dest)
+        flt, date, dest = _pick(row, (c_flt, c_date, c_dest))
 
         is_new = bool(flt or date) and (
             current is None
@@ -1118,19 +1502,20 @@ def _parse_type_b(all_rows: list[list[str]]) -> list[dict]:
             flights.append(current)
 
         if current is not None:
+            item_v, pcs, rsn, email, phys, trol, cms, rmk = _pick(row, item_cols)
             item = {
-                "item":        _get(row, c_item),
+                "item":        item_v,
                 "awb":         "",
-                "pcs":         _get(row, c_pcs),
+                "pcs":         pcs,
                 "kgs":         "",
                 "description": "",
                 "class_":      "",
-                "reason":      _get(row, c_rsn),
-                "email":       _get(row, c_email),
-                "physical":    _get(row, c_phys),
-                "trolley":     _get(row, c_trol),
-                "cms":         _get(row, c_cms),
-                "remarks":     _get(row, c_rmk),
+                "reason":      rsn,
+                "email":       email,
+                "physical":    phys,
+                "trolley":     trol,
+                "cms":         cms,
+                "remarks":     rmk,
             }
             if any(item.values()):
                 current["items"].append(item)
@@ -1144,7 +1529,7 @@ def _parse_type_b(all_rows: list[list[str]]) -> list[dict]:
 #  703 13436275   14   SPORTS WERAS   B   194.0   SKTDUS
 #  CGO OFFLOADED DUE SPACE
 # ────────────────────────────────────────────────────────────────
-def _parse_type_c(soup: BeautifulSoup) -> list[dict]:
+def _parse_type_c(full_text: str) -> list[dict]:
     """
     يستخرج الرحلات من النصوص الحرة في الإيميل (ليس جداول).
     العنوان: OFFLOADED CARGO ON <FLIGHT>/<DATE>
@@ -1153,25 +1538,12 @@ def _parse_type_c(soup: BeautifulSoup) -> list[dict]:
     """
     flights = []
 
-    # استخرج كل النصوص من الصفحة
-    full_text = soup.get_text("\n")
+    # full_text = كل النصوص من الصفحة (سطر لكل عقدة نص)
     lines     = [ln.strip() for ln in full_text.splitlines() if ln.strip()]
 
-    # نمط العنوان: OFFLOADED CARGO ON WY237/27FEB أو OFFLOADED CARGO ON OV237/27FEB
-    title_pat  = re.compile(
-        r"OFFLOAD(?:ED)?\s+CARGO\s+ON\s+([A-Z0-9]{2,6})\s*/\s*(\w+)",
-        re.IGNORECASE,
-    )
-    # نمط سطر البيانات: رقم AWB ثم PCS ثم DESC ثم CLASS ثم KGS ثم DEST
-    # مثال: 703 13436275   14   SPORTS WERAS   B   194.0   SKTDUS
-    data_pat   = re.compile(
-        r"^(\d[\d\s]{5,15})\s{2,}(\d+)\s{2,}(.+?)\s{2,}([A-Z])\s{2,}([\d.]+)\s{2,}([A-Z]{3,6})\s*$"
-    )
-    reason_pat = re.compile(r"CGO\s+OFFLOAD(?:ED)?\s+DUE\s+(.+)", re.IGNORECASE)
-
     i = 0
     while i < len(lines):
-        m_title = title_pat.search(lines[i])
+        m_title = _TYPE_C_TITLE_RE.search(lines[i])
         if m_title:
             flight_num = m_title.group(1).upper()
             date       = m_title.group(2).upper()
@@ -1182,7 +1554,7 @@ def _parse_type_c(soup: BeautifulSoup) -> list[dict]:
             # ابحث في الأسطر التالية عن البيانات والسبب
             j = i + 1
             while j < len(lines) and j < i + 30:
-                m_data = data_pat.match(lines[j])
+                m_data = _TYPE_C_DATA_RE.match(lines[j])
                 if m_data:
                     awb   = m_data.group(1).strip()
                     pcs   = m_data.group(2).strip()
@@ -1206,7 +1578,7 @@ def _parse_type_c(soup: BeautifulSoup) -> list[dict]:
                         "remarks":     "",
                     })
 
-                m_rsn = reason_pat.search(lines[j])
+                m_rsn = _TYPE_C_REASON_RE.search(lines[j])
                 if m_rsn:
                     reason = m_rsn.group(1).strip()
                     # أضف السبب لكل الشحنات
@@ -1252,6 +1624,8 @@ def save_flights(flights: list[dict], now: datetime) -> tuple[str, str, dict, li
 
     metas_by_folder: dict[Path, dict] = {}
     affected_date_dirs: set[str] = set()
+    # الكتابة تتم في النهاية دفعة واحدة (آخر نسخة لنفس الملف هي المعتمدة)
+    pending_writes: dict[Path, dict] = {}
 
     for flight in flights:
         flight_date_dir = normalize_flight_date(flight.get("date", ""), now) or operational_date_dir
@@ -1272,7 +1646,7 @@ def save_flights(flights: list[dict], now: datetime) -> tuple[str, str, dict, li
             f"{flight['flight']}_{flight.get('date','')}_{flight.get('destination','')}"
         ) + ".json"
         file_path = folder / filename
-        existed = file_path.exists()
+        existed = file_path in pending_writes or file_path.exists()
 
         payload = {
             **flight,
@@ -1280,7 +1654,7 @@ def save_flights(flights: list[dict], now: datetime) -> tuple[str, str, dict, li
             "storage_date_dir": flight_date_dir,
             "storage_shift": shift,
         }
-        file_path.write_text(json.dumps(payload, ensure_ascii=False, indent=2), encoding="utf-8")
+        pending_writes[file_path] = payload
 
         entry = meta["flights"].get(filename, {
             "flight": flight["flight"],
@@ -1297,8 +1671,8 @@ def save_flights(flights: list[dict], now: datetime) -> tuple[str, str, dict, li
         entry["storage_shift"] = shift
         meta["flights"][filename] = entry
 
-    for meta_path, meta in metas_by_folder.items():
-        write_json(meta_path, meta)
+    pending_writes.update(metas_by_folder)
+    _write_json_many(pending_writes)
 
     operational_meta = metas_by_folder.get(
         DATA_DIR / operational_date_dir / shift / "meta.json",
@@ -1329,14 +1703,14 @@ def _format_std_etd(raw: str) -> tuple[str, str]:
         return "", ""
 
     # Grab time tokens HH:MM (or H:MM)
-    times = re.findall(r"\b(\d{1,2}:\d{2})\b", s)
+    times = _H_MM_WORD_RE.findall(s)
     if len(times) >= 2:
         return times[0], times[1]
     if len(times) == 1:
         return times[0], ""
 
     # Fallback: handle 3-4 digit times like 1425
-    nums = re.findall(r"\b(\d{3,4})\b", s)
+    nums = _HHMM_DIGITS_RE.findall(s)
     def to_hhmm(n: str) -> str:
         n = n.zfill(4)
         return f"{n[:2]}:{n[2:]}"
@@ -1386,19 +1760,22 @@ def _roster_request_headers() -> dict[str, str]:
     }
 
 
-def _fetch_daily_roster_html(date_dir: str) -> str:
+# صفحة الروستر لليوم واحدة لكل المناوبات الثلاث — تُجلب مرة واحدة في كل تشغيل
+@lru_cache(maxsize=64)
+def _fetch_daily_roster_html(date_dir: str) -> str | bytes:
     """Fetch the Export daily roster HTML page for a specific date."""
     day_url = f"{ROSTER_PAGE_URL.rstrip('/')}/date/{date_dir}/"
-    response = requests.get(
+    response = _FILE_SESSION.get(
         day_url,
         timeout=20,
         headers=_roster_request_headers(),
     )
     response.raise_for_status()
-    return response.text
+    return _response_html(response)
 
 
-def _fetch_import_roster_html(date_dir: str) -> str:
+@lru_cache(maxsize=64)
+def _fetch_import_roster_html(date_dir: str) -> str | bytes:
     """Fetch the Import daily roster HTML page for a specific date.
 
     Tries the published page first, then falls back to raw GitHub HTML.
@@ -1407,26 +1784,41 @@ def _fetch_import_roster_html(date_dir: str) -> str:
         f"{ROSTER_PAGE_URL.rstrip('/')}/import/{date_dir}/",
         f"{ROSTER_IMPORT_RAW_BASE.rstrip('/')}/{date_dir}/index.html",
     ]
+
+    def _fetch_html(url: str) -> str | bytes:
+        response = _FILE_SESSION.get(
+            url,
+            timeout=20,
+            headers=_roster_request_headers(),
+        )
+        response.raise_for_status()
+        return _response_html(response)
+
+    # الطلبان معاً: إذا فشل الأول لا ننتظر مهلته ثم نبدأ الثاني.
+    # الأولوية تبقى بالترتيب — نتيجة الصفحة المنشورة تُفضَّل متى نجحت.
     last_exc: Exception | None = None
-    for url in candidates:
-        try:
-            response = requests.get(
-                url,
-                timeout=20,
-                headers=_roster_request_headers(),
-            )
-            response.raise_for_status()
-            return response.text
-        except Exception as exc:
-            last_exc = exc
+    pool = ThreadPoolExecutor(max_workers=len(candidates))
+    try:
+        for future in [pool.submit(_fetch_html, url) for url in candidates]:
+            try:
+                return future.result()
+            except Exception as exc:
+                last_exc = exc
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
     raise last_exc or RuntimeError(f"Import roster fetch failed for {date_dir}")
 
 
-def _normalize_import_roster_lines(html: str) -> list[str]:
-    text = BeautifulSoup(html, "html.parser").get_text("\n")
+def _normalize_import_roster_lines(html: str | bytes) -> list[str]:
+    if _etree is not None:
+        root = _lxml_root(html)
+        text = "\n".join(_TEXT_XPATH(root)) if root is not None else ""
+    else:
+        from bs4 import BeautifulSoup
+        text = BeautifulSoup(html, _HTML_PARSER).get_text("\n")
     lines: list[str] = []
     for raw_line in text.splitlines():
-        line = re.sub(r"\s+", " ", (raw_line or "")).strip()
+        line = _WS_RE.sub(" ", (raw_line or "")).strip()
         if line:
             lines.append(line)
     return lines
@@ -1469,7 +1861,7 @@ _IMPORT_FLIGHT_DISPATCH_KEYS: dict[str, str] = {
 
 
 def _parse_import_employee_line(line: str, dept: str) -> dict | None:
-    m = re.match(r"^(.+?)\s*[·•\-–]\s*(\d{3,6})\b.*$", line)
+    m = _IMPORT_EMP_LINE_RE.match(line)
     if not m:
         return None
     return {
@@ -1539,6 +1931,42 @@ def fetch_import_flight_dispatch_staff(date_dir: str, shift: str) -> dict:
     return result
 
 
+def _roster_dept_cards(html: str | bytes) -> list[tuple[str, list[tuple[str, list[str]]]]]:
+    """[(dept, [(data-shift, [empName text, ...]), ...]), ...] من صفحة الروستر اليومية."""
+    cards: list[tuple[str, list[tuple[str, list[str]]]]] = []
+    if _etree is None:
+        from bs4 import BeautifulSoup
+        soup = BeautifulSoup(html, _HTML_PARSER)
+        for dept_card in soup.select(".deptCard"):
+            dept_el = dept_card.select_one(".deptTitle")
+            shifts = []
+            for shift_card in dept_card.select("details.shiftCard"):
+                names = []
+                for emp_row in shift_card.select(".empRow"):
+                    name_el = emp_row.select_one(".empName")
+                    if name_el:
+                        names.append(name_el.get_text(" ", strip=True))
+                shifts.append((shift_card.get("data-shift") or "", names))
+            cards.append((dept_el.get_text(" ", strip=True) if dept_el else "Unknown", shifts))
+        return cards
+
+    root = _lxml_root(html)
+    if root is None:
+        return cards
+    for dept_card in _ROSTER_DEPT_CARDS(root):
+        dept_el = _ROSTER_DEPT_TITLE(dept_card)
+        shifts = []
+        for shift_card in _ROSTER_SHIFT_CARDS(dept_card):
+            names = []
+            for emp_row in _ROSTER_EMP_ROWS(shift_card):
+                name_el = _ROSTER_EMP_NAME(emp_row)
+                if name_el:
+                    names.append(_lxml_get_text(name_el[0]))
+            shifts.append((shift_card.get("data-shift") or "", names))
+        cards.append((_lxml_get_text(dept_el[0]) if dept_el else "Unknown", shifts))
+    return cards
+
+
 def fetch_roster_staff(date_dir: str, shift: str) -> dict:
     """Fetch staff on duty from the Export daily roster HTML page for the given date/shift.
 
@@ -1554,7 +1982,7 @@ def fetch_roster_staff(date_dir: str, shift: str) -> dict:
 
     try:
         html = _fetch_daily_roster_html(date_dir)
-        soup = BeautifulSoup(html, "html.parser")
+        dept_cards = _roster_dept_cards(html)
     except Exception as e:
         print(f"  [roster-html] Failed to fetch/parse {date_dir}: {e}")
         return {"on_duty": [], "on_leave": []}
@@ -1562,27 +1990,20 @@ def fetch_roster_staff(date_dir: str, shift: str) -> dict:
     on_duty: list[dict] = []
     on_leave: list[dict] = []
 
-    for dept_card in soup.select(".deptCard"):
-        dept_el = dept_card.select_one(".deptTitle")
-        dept = dept_el.get_text(" ", strip=True) if dept_el else "Unknown"
+    for dept, shift_cards in dept_cards:
         dept_norm = dept.strip().lower()
 
-        for shift_card in dept_card.select("details.shiftCard"):
-            shift_label = _normalize_shift_label(shift_card.get("data-shift") or "")
-
-            for emp_row in shift_card.select(".empRow"):
-                name_el = emp_row.select_one(".empName")
-                if not name_el:
-                    continue
+        for data_shift, raw_names in shift_cards:
+            shift_label = _normalize_shift_label(data_shift)
 
-                raw_name = name_el.get_text(" ", strip=True)
+            for raw_name in raw_names:
                 sn = ""
                 name = raw_name
 
                 # Matches both:
                 #   Mohamed Al Amri - 81404
                 #   Mohamed Al Subhi - 82592 (Inventory)
-                m = re.match(r"^(.+?)\s*[-–]\s*(\d+)(?:\s*\(.*?\))?\s*$", raw_name)
+                m = _ROSTER_NAME_SN_RE.match(raw_name)
                 if m:
                     name = m.group(1).strip()
                     sn = m.group(2).strip()
@@ -1613,6 +2034,90 @@ def fetch_roster_staff(date_dir: str, shift: str) -> dict:
 #  بناء صفحات HTML
 # ══════════════════════════════════════════════════════════════════
 
+# ── قالب صف جدول الأوفلود (يُستخدم لصفوف الرحلات والصفوف الفارغة) ──
+# t = قائمة tabindex لكل خلية قابلة للتعديل (فارغة لصفوف NIL)
+_OFFLOAD_ROW_TMPL = """
+      <tr>
+        <td {td}><strong>{num}</strong></td>
+        <td {td} contenteditable="true"{t[0]} data-col="date">{date}</td>
+        <td {td} contenteditable="true"{t[1]} data-col="flight">{flight}</td>
+        <td {td} contenteditable="true"{t[2]} data-col="std">{std}</td>
+        <td {td} contenteditable="true"{t[3]} data-col="dest">{dest}</td>
+        <td {td} contenteditable="true"{t[4]} data-col="email">{email}</td>
+        <td {td} contenteditable="true"{t[5]}>{physical}</td>
+        <td {td} contenteditable="true"{t[6]}>{uld}</td>
+        <td {td} contenteditable="true"{t[7]}>{cms}</td>
+        <td {td} contenteditable="true"{t[8]}>{verified}</td>
+        <td {td} contenteditable="true"{t[9]}>{reason}</td>
+        <td {td} contenteditable="true"{t[10]}>{remarks}</td>
+        <td {td}>
+          <button type="button" data-no-copy="1" onclick="deleteOffloadRow(this)"
+            style="font-size:11px;padding:2px 7px;cursor:pointer;background:#fee2e2;border:1px solid #dc2626;color:#dc2626;border-radius:3px;">
+            &#10005;
+          </button>
+        </td>
+      </tr>"""
+_OFFLOAD_EDITABLE_COLS = 11
+_OFFLOAD_BLANK_CELLS = dict.fromkeys(
+    ("date", "flight", "std", "dest", "email", "physical", "uld",
+     "cms", "verified", "reason", "remarks"),
+    "&nbsp;",
+)
+_NO_TABINDEX = ("",) * _OFFLOAD_EDITABLE_COLS
+
+
+def _as_int(v) -> int:
+    """PCS كعدد صحيح — int جاهز يُعاد مباشرة، وأي قيمة غير رقمية تُحسب 0."""
+    if type(v) is int:
+        return v
+    try:
+        return int(v or 0)
+    except (ValueError, TypeError):
+        return 0
+
+
+def _tabindex_attrs(start: int) -> list[str]:
+    return [f' tabindex="{n}"' for n in range(start, start + _OFFLOAD_EDITABLE_COLS)]
+
+
+# ── style خلايا الصفوف (inline لأن الإيميل يحذف class) — متغيرات ثابتة تُبنى مرة واحدة ──
+_OFFLOAD_TD_STYLE = (
+    'style="padding:7px 6px;border:1px solid #d0d9ee;'
+    'font-size:12px;font-family:Calibri,Arial,sans-serif;color:#1b1f2a;'
+    'background:{bg};text-align:center;{valign}"'
+)
+# مفهرسة بـ item_num % 2: الصفوف الزوجية ملونة والفردية بيضاء
+_OFFLOAD_ROW_TD = (
+    _OFFLOAD_TD_STYLE.format(bg="#f4f7fc", valign="vertical-align:middle;"),
+    _OFFLOAD_TD_STYLE.format(bg="#ffffff", valign="vertical-align:middle;"),
+)
+_OFFLOAD_EMPTY_TD = _OFFLOAD_TD_STYLE.format(bg="#ffffff", valign="")
+
+# ── صف عناوين الأعمدة (ثابت — يُبنى مرة واحدة عند تحميل الموديول) ──
+_OFFLOAD_COLUMNS = (
+    ("ITEM", "40px"),
+    ("DATE", "80px"),
+    ("FLIGHT", "80px"),
+    ("STD/ETD", "80px"),
+    ("DEST", "60px"),
+    ("Email Received Time", "90px"),
+    ("Physical Cargo Received from Ramp", "100px"),
+    ("Trolley/ ULD Number", "90px"),
+    ("Offloading Process Completed in CMS", "100px"),
+    ("Offloading Pieces Verification", "100px"),
+    ("Offloading Reason", "100px"),
+    ("Remarks/Additional Information", ""),
+    ("Delete", "55px"),
+)
+_OFFLOAD_COL_HEADERS_HTML = "<tr>" + "".join(
+    '<td style="padding:8px 6px; background-color:#dce6f4; color:#1b1f2a;'
+    'font-weight:700; font-size:11px; font-family:Calibri,Arial,sans-serif;'
+    'border:1px solid #a8bcd8; text-align:center; vertical-align:middle; '
+    f'{f"width:{width};" if width else ""}">{label}</td>'
+    for label, width in _OFFLOAD_COLUMNS
+) + "</tr>"
+
+
 def _render_offload_table(flights: list[dict], meta: dict) -> str:
     """Render offload section as a single vertical table (Type B style).
     Columns: ITEM | DATE | FLIGHT | STD/ETD | DEST | Email Received Time |
@@ -1624,46 +2129,13 @@ def _render_offload_table(flights: list[dict], meta: dict) -> str:
         flights = []
 
     # ── Styles ──
-    hdr_bg      = "#dce6f4"
-    hdr_color   = "#1b1f2a"
-    hdr_border  = "#a8bcd8"
     row_even    = "#ffffff"
-    row_odd     = "#f4f7fc"
     cell_border = "#d0d9ee"
     nil_color   = "#64748b"
-    text_dark   = "#1b1f2a"
     totals_bg   = "#eef3fc"
     totals_border = "#0b3a78"
     totals_color = "#0b3a78"
 
-    # ── Column headers ──
-    columns = [
-        ("ITEM", "40px"),
-        ("DATE", "80px"),
-        ("FLIGHT", "80px"),
-        ("STD/ETD", "80px"),
-        ("DEST", "60px"),
-        ("Email Received Time", "90px"),
-        ("Physical Cargo Received from Ramp", "100px"),
-        ("Trolley/ ULD Number", "90px"),
-        ("Offloading Process Completed in CMS", "100px"),
-        ("Offloading Pieces Verification", "100px"),
-        ("Offloading Reason", "100px"),
-        ("Remarks/Additional Information", ""),
-        ("Delete", "55px"),
-    ]
-
-    col_headers = "<tr>"
-    for label, width in columns:
-        w = f"width:{width};" if width else ""
-        col_headers += (
-            f'<td style="padding:8px 6px; background-color:{hdr_bg}; color:{hdr_color};'
-            f'font-weight:700; font-size:11px; font-family:Calibri,Arial,sans-serif;'
-            f'border:1px solid {hdr_border}; text-align:center; vertical-align:middle; {w}">'
-            f'{label}</td>'
-        )
-    col_headers += "</tr>"
-
     # ── Deduplicate flights by flight number (keep first occurrence) ──
     seen_flights: set[str] = set()
     unique_flights: list[dict] = []
@@ -1676,27 +2148,25 @@ def _render_offload_table(flights: list[dict], meta: dict) -> str:
         unique_flights.append(f)
     flights = unique_flights
 
-    # ── Data rows ──
-    data_rows = ""
+    # ── Data rows (تُجمع في list ثم join مرة واحدة) ──
+    rows: list[str] = []
     item_num = 0
 
     # tabindex counter for Tab navigation
-    _ti = [1]
-    def _next_ti():
-        v = _ti[0]; _ti[0] += 1; return v
+    ti = 1
 
     def _format_full_date(raw: str) -> str:
         """Force date into DD-MMM-YY format (e.g. 15-MAR-26) no matter what input arrives."""
         raw = (raw or "").strip()
         if not raw or raw == "—":
             # No date provided — use today's date in Muscat timezone
-            today = datetime.now(ZoneInfo(TIMEZONE))
+            today = datetime.now(LOCAL_TZ)
             return today.strftime("%d-%b-%y").upper()
 
         raw_up = raw.upper().replace("/", "-").replace(".", "-")
 
         # 1) ISO: 2026-03-15 or 2026-03-15T...
-        m = re.match(r"(\d{4})-(\d{1,2})-(\d{1,2})", raw_up)
+        m = _ISO_DATE_PREFIX_RE.match(raw_up)
         if m:
             try:
                 dt = datetime(int(m.group(1)), int(m.group(2)), int(m.group(3)))
@@ -1713,22 +2183,22 @@ def _render_offload_table(flights: list[dict], meta: dict) -> str:
                 pass
 
         # 3) Short without year: 15MAR or 15-MAR — attach current year
-        m = re.match(r"(\d{1,2})-?([A-Z]{3})$", raw_up)
+        m = _SHORT_DATE_RE.match(raw_up)
         if m:
             try:
-                yr = datetime.now(ZoneInfo(TIMEZONE)).year
+                yr = datetime.now(LOCAL_TZ).year
                 dt = datetime.strptime(f"{m.group(1)}{m.group(2)}{yr}", "%d%b%Y")
                 return dt.strftime("%d-%b-%y").upper()
             except ValueError:
                 pass
 
         # 4) Try extracting any day+month from the string
-        m = re.search(r"(\d{1,2})\s*-?\s*([A-Z]{3})\s*-?\s*(\d{2,4})?", raw_up)
+        m = _ANY_DAY_MON_RE.search(raw_up)
         if m:
             day, mon = m.group(1), m.group(2)
             yr_str = m.group(3)
             if not yr_str:
-                yr_str = str(datetime.now(ZoneInfo(TIMEZONE)).year)
+                yr_str = str(datetime.now(LOCAL_TZ).year)
             try:
                 dt = datetime.strptime(f"{day}{mon}{yr_str}", "%d%b%Y" if len(yr_str) == 4 else "%d%b%y")
                 return dt.strftime("%d-%b-%y").upper()
@@ -1736,7 +2206,7 @@ def _render_offload_table(flights: list[dict], meta: dict) -> str:
                 pass
 
         # 5) Absolute fallback — return today's date
-        today = datetime.now(ZoneInfo(TIMEZONE))
+        today = datetime.now(LOCAL_TZ)
         return today.strftime("%d-%b-%y").upper()
 
     def _to_muscat_time(time_str: str) -> str:
@@ -1753,22 +2223,22 @@ def _render_offload_table(flights: list[dict], meta: dict) -> str:
         try:
             dt = datetime.fromisoformat(s)
             if dt.tzinfo is not None:
-                dt = dt.astimezone(ZoneInfo(TIMEZONE))
+                dt = dt.astimezone(LOCAL_TZ)
                 return dt.strftime("%H:%M")
             # ISO without tz -> treat as UTC
-            dt = dt.replace(tzinfo=ZoneInfo("UTC"))
-            return dt.astimezone(ZoneInfo(TIMEZONE)).strftime("%H:%M")
+            dt = dt.replace(tzinfo=UTC_TZ)
+            return dt.astimezone(LOCAL_TZ).strftime("%H:%M")
         except (ValueError, TypeError):
             pass
         # Bare HH:MM -> treat as UTC and convert to Muscat (UTC+4)
-        m_t = re.match(r"^(\d{1,2}):(\d{2})$", s)
+        m_t = _H_MM_EXACT_RE.match(s)
         if m_t:
             try:
-                today = datetime.now(ZoneInfo(TIMEZONE)).date()
+                today = datetime.now(LOCAL_TZ).date()
                 dt_utc = datetime(today.year, today.month, today.day,
                                   int(m_t.group(1)), int(m_t.group(2)),
-                                  tzinfo=ZoneInfo("UTC"))
-                converted = dt_utc.astimezone(ZoneInfo(TIMEZONE)).strftime("%H:%M")
+                                  tzinfo=UTC_TZ)
+                converted = dt_utc.astimezone(LOCAL_TZ).strftime("%H:%M")
                 if converted != s:
                     print(f"  [tz-convert] STD/ETD {s!r} (UTC) -> {converted!r} (MCT)")
                 return converted
@@ -1799,102 +2269,61 @@ def _render_offload_table(flights: list[dict], meta: dict) -> str:
                 try:
                     _sa_dt = datetime.fromisoformat(_saved_at)
                     if _sa_dt.tzinfo is not None:
-                        _sa_dt = _sa_dt.astimezone(ZoneInfo(TIMEZONE))
+                        _sa_dt = _sa_dt.astimezone(LOCAL_TZ)
                     email = _sa_dt.strftime("%H:%M")
                 except Exception:
                     email = ""
         physical = (flight.get("physical")   or "").strip().upper() or ""
         cms      = (flight.get("cms")        or "").strip().upper() or ""
+        remarks  = (flight.get("remarks")    or "").strip().upper() or ""
+
+        # ── تمريرة واحدة على الشحنات: مجموع القطع + الأسباب + الترولي ──
         # Pieces verification: sum PCS from all items
+        # Reason / Trolley-ULD: unique values from items with an AWB only
+        # (trolley field only — never fall back to AWB numbers)
         total_pcs = 0
+        reasons: dict[str, None] = {}
+        uld_parts: dict[str, None] = {}
         for it in flight.get("items", []):
-            try:
-                total_pcs += int(it.get("pcs", 0) or 0)
-            except (ValueError, TypeError):
-                pass
-        verified = str(total_pcs) if total_pcs > 0 else ""
-        remarks  = (flight.get("remarks")    or "").strip().upper() or ""
-
-        items = flight.get("items", [])
-        real_items = [i for i in items if (i.get("awb","") or "").strip()]
-
-        # ── Single row per flight ──
-        item_num += 1
-        bg = row_odd if item_num % 2 == 0 else row_even
-
-        td_s = (f'style="padding:7px 6px;border:1px solid {cell_border};'
-                f'font-size:12px;font-family:Calibri,Arial,sans-serif;color:{text_dark};'
-                f'background:{bg};text-align:center;vertical-align:middle;"')
-
-        # Offloading reason: combine unique reasons from items
-        reasons = []
-        for it in real_items:
+            total_pcs += _as_int(it.get("pcs"))
+            if not (it.get("awb", "") or "").strip():
+                continue
             r = (it.get("reason", "") or "").strip().upper()
-            if r and r not in reasons:
-                reasons.append(r)
-        reason_display = ", ".join(reasons) if reasons else ""
-
-        # Trolley/ULD: only use trolley field — never fall back to AWB numbers
-        uld_parts = []
-        for it in real_items:
+            if r:
+                reasons[r] = None
             u = (it.get("trolley", "") or "").strip().upper()
-            if u and u not in uld_parts:
-                uld_parts.append(u)
-        uld_display = ", ".join(uld_parts) if uld_parts else ""
+            if u:
+                uld_parts[u] = None
+        verified       = str(total_pcs) if total_pcs > 0 else ""
+        reason_display = ", ".join(reasons)
+        uld_display    = ", ".join(uld_parts)
 
-        data_rows += f"""
-      <tr>
-        <td {td_s}><strong>{item_num}</strong></td>
-        <td {td_s} contenteditable="true" tabindex="{_next_ti()}" data-col="date">{date}</td>
-        <td {td_s} contenteditable="true" tabindex="{_next_ti()}" data-col="flight">{flt}</td>
-        <td {td_s} contenteditable="true" tabindex="{_next_ti()}" data-col="std">{std_etd_display}</td>
-        <td {td_s} contenteditable="true" tabindex="{_next_ti()}" data-col="dest">{dest}</td>
-        <td {td_s} contenteditable="true" tabindex="{_next_ti()}" data-col="email">{email}</td>
-        <td {td_s} contenteditable="true" tabindex="{_next_ti()}">{physical}</td>
-        <td {td_s} contenteditable="true" tabindex="{_next_ti()}">{uld_display}</td>
-        <td {td_s} contenteditable="true" tabindex="{_next_ti()}">{cms}</td>
-        <td {td_s} contenteditable="true" tabindex="{_next_ti()}">{verified}</td>
-        <td {td_s} contenteditable="true" tabindex="{_next_ti()}">{reason_display}</td>
-        <td {td_s} contenteditable="true" tabindex="{_next_ti()}">{remarks}</td>
-        <td {td_s}>
-          <button type="button" data-no-copy="1" onclick="deleteOffloadRow(this)"
-            style="font-size:11px;padding:2px 7px;cursor:pointer;background:#fee2e2;border:1px solid #dc2626;color:#dc2626;border-radius:3px;">
-            &#10005;
-          </button>
-        </td>
-      </tr>"""
+        # ── Single row per flight ──
+        # القيم نصوص خام من الإيميل/المستخدم — تُهرَّب مرة واحدة هنا (& < > تكسر الجدول)
+        item_num += 1
+        cells = {
+            "date": date, "flight": flt, "std": std_etd_display, "dest": dest,
+            "email": email, "physical": physical, "uld": uld_display, "cms": cms,
+            "verified": verified, "reason": reason_display, "remarks": remarks,
+        }
+        for k, v in cells.items():
+            cells[k] = _html_escape(v, quote=False)
+        rows.append(_OFFLOAD_ROW_TMPL.format(
+            td=_OFFLOAD_ROW_TD[item_num % 2], num=item_num, t=_tabindex_attrs(ti), **cells,
+        ))
+        ti += _OFFLOAD_EDITABLE_COLS
 
     # ── 3 empty rows for manual entry ──
-    _empty_td = (f'style="padding:7px 6px;border:1px solid {cell_border};'
-                 f'font-size:12px;font-family:Calibri,Arial,sans-serif;color:{text_dark};'
-                 f'background:{row_even};text-align:center;"')
     for _ in range(3):
         item_num += 1
-        data_rows += f"""
-      <tr>
-        <td {_empty_td}><strong>{item_num}</strong></td>
-        <td {_empty_td} contenteditable="true" tabindex="{_next_ti()}" data-col="date">&nbsp;</td>
-        <td {_empty_td} contenteditable="true" tabindex="{_next_ti()}" data-col="flight">&nbsp;</td>
-        <td {_empty_td} contenteditable="true" tabindex="{_next_ti()}" data-col="std">&nbsp;</td>
-        <td {_empty_td} contenteditable="true" tabindex="{_next_ti()}" data-col="dest">&nbsp;</td>
-        <td {_empty_td} contenteditable="true" tabindex="{_next_ti()}" data-col="email">&nbsp;</td>
-        <td {_empty_td} contenteditable="true" tabindex="{_next_ti()}">&nbsp;</td>
-        <td {_empty_td} contenteditable="true" tabindex="{_next_ti()}">&nbsp;</td>
-        <td {_empty_td} contenteditable="true" tabindex="{_next_ti()}">&nbsp;</td>
-        <td {_empty_td} contenteditable="true" tabindex="{_next_ti()}">&nbsp;</td>
-        <td {_empty_td} contenteditable="true" tabindex="{_next_ti()}">&nbsp;</td>
-        <td {_empty_td} contenteditable="true" tabindex="{_next_ti()}">&nbsp;</td>
-        <td {_empty_td}>
-          <button type="button" data-no-copy="1" onclick="deleteOffloadRow(this)"
-            style="font-size:11px;padding:2px 7px;cursor:pointer;background:#fee2e2;border:1px solid #dc2626;color:#dc2626;border-radius:3px;">
-            &#10005;
-          </button>
-        </td>
-      </tr>"""
+        rows.append(_OFFLOAD_ROW_TMPL.format_map(
+            {**_OFFLOAD_BLANK_CELLS, "td": _OFFLOAD_EMPTY_TD, "num": item_num, "t": _tabindex_attrs(ti)}
+        ))
+        ti += _OFFLOAD_EDITABLE_COLS
 
     # ── NIL case ──
     if not flights:
-        data_rows = f"""
+        rows = [f"""
       <tr id="nil-row">
         <td colspan="13" style="padding:10px 10px; border:1px solid {cell_border};
             color:{nil_color}; text-align:center; font-style:italic; font-size:12px;
@@ -1903,35 +2332,19 @@ def _render_offload_table(flights: list[dict], meta: dict) -> str:
           &nbsp;<button onclick="var r=document.getElementById('nil-row');if(r)r.remove();triggerAutosave();"
             style="font-size:10px;padding:1px 7px;cursor:pointer;background:#fee2e2;border:1px solid #dc2626;color:#dc2626;border-radius:3px;vertical-align:middle;">\u2715 Remove</button>
         </td>
-      </tr>"""
+      </tr>"""]
         # Add 3 empty rows even for NIL
         for i in range(1, 4):
-            data_rows += f"""
-      <tr>
-        <td {_empty_td}><strong>{i}</strong></td>
-        <td {_empty_td} contenteditable="true" data-col="date">&nbsp;</td>
-        <td {_empty_td} contenteditable="true" data-col="flight">&nbsp;</td>
-        <td {_empty_td} contenteditable="true" data-col="std">&nbsp;</td>
-        <td {_empty_td} contenteditable="true" data-col="dest">&nbsp;</td>
-        <td {_empty_td} contenteditable="true" data-col="email">&nbsp;</td>
-        <td {_empty_td} contenteditable="true">&nbsp;</td>
-        <td {_empty_td} contenteditable="true">&nbsp;</td>
-        <td {_empty_td} contenteditable="true">&nbsp;</td>
-        <td {_empty_td} contenteditable="true">&nbsp;</td>
-        <td {_empty_td} contenteditable="true">&nbsp;</td>
-        <td {_empty_td} contenteditable="true">&nbsp;</td>
-        <td {_empty_td}>
-          <button type="button" data-no-copy="1" onclick="deleteOffloadRow(this)"
-            style="font-size:11px;padding:2px 7px;cursor:pointer;background:#fee2e2;border:1px solid #dc2626;color:#dc2626;border-radius:3px;">
-            &#10005;
-          </button>
-        </td>
-      </tr>"""
+            rows.append(_OFFLOAD_ROW_TMPL.format_map(
+                {**_OFFLOAD_BLANK_CELLS, "td": _OFFLOAD_EMPTY_TD, "num": i, "t": _NO_TABINDEX}
+            ))
+
+    data_rows = "".join(rows)
 
     table_html = f"""
     <table width="100%" cellpadding="0" cellspacing="0" border="0"
            style="border-collapse:collapse; font-family:Calibri,Arial,sans-serif; margin-top:12px; margin-bottom:14px;">
-      {col_headers}
+      {_OFFLOAD_COL_HEADERS_HTML}
       <tbody id="offload-tbody">
       {data_rows}
       </tbody>
@@ -1940,6 +2353,22 @@ def _render_offload_table(flights: list[dict], meta: dict) -> str:
     return f'<div class="offload-scroll" style="margin-top:12px;">{table_html}</div>'
 
 
+# ── اسم موظف في MANPOWER: SN بالخط العريض ثم الاسم (inline styles — آمنة للنسخ في Outlook) ──
+_MANPOWER_NAME_TMPL = (
+    '<span data-sn="{sn}" data-name="{name}" '
+    'style="font-family:Calibri,Arial,sans-serif;color:#1b1f2a;white-space:nowrap;">'
+    '<strong style="font-weight:700;color:#1b1f2a;letter-spacing:0.3px;">SN{sn}</strong>'
+    '&nbsp;&nbsp;<span style="font-weight:400;color:#1b1f2a;">{name}</span>'
+    '</span>'
+)
+
+# ── قالب قسم في MANPOWER: عنوان + قائمة قابلة للتعديل + زر الإضافة ──
+_MANPOWER_DEPT_TMPL = """
+      <div style="{dept_hdr}">{title}:</div>
+      <ul id="{ul_id}" class="{ul_class}" style="{ul_style}">{items}</ul>
+      <button onclick="addListItem('{ul_id}')" style="font-size:11px;padding:1px 8px;margin:2px 0 8px;cursor:pointer;background:#eef3fc;border:1px solid #0b3a78;color:#0b3a78;border-radius:3px;">+ Add</button>"""
+
+
 def _render_manpower_section(roster: dict, supervisor_display: str = "", import_roster: dict | None = None) -> str:
     """Render Section 6 MANPOWER — grouped by dept, sections B-G."""
     # re is already imported at module level
@@ -1971,26 +2400,23 @@ def _render_manpower_section(roster: dict, supervisor_display: str = "", import_
         raw  = emp.get("name","").strip()
         sn   = str(emp.get("sn") or "").strip()
         # استخراج SN والاسم إذا كانا مدمجَين في raw
-        m = re.match(r"^(.+?)\s*-\s*(\d{4,})\s*(?:\((.+?)\))?$", raw)
+        m = _EMP_NAME_SN_RE.match(raw)
         if m:
             name_part = m.group(1).strip()
             sn_part   = m.group(2).strip()
         else:
             name_part = raw
             sn_part   = sn
+        # نصوص الروستر خام (بعد فك entities) — تُهرَّب مرة واحدة قبل القالب
+        # (مع علامات الاقتباس: الاسم يدخل أيضاً في data-name="...")
+        name_part = _html_escape(name_part)
+        sn_part   = _html_escape(sn_part)
 
         # Outlook/mobile-safe: لا نستخدم flex/gap لأن Outlook يحذفها عند النسخ.
         # نضع فاصل HTML حقيقي بين SN والاسم حتى يظهر بعد اللصق دائماً.
-        sn_display = f"SN{sn_part}" if sn_part else ""
-        if sn_display and name_part:
-            return (
-                f'<span data-sn="{sn_part}" data-name="{name_part}" '
-                f'style="font-family:Calibri,Arial,sans-serif;color:#1b1f2a;white-space:nowrap;">'
-                f'<strong style="font-weight:700;color:#1b1f2a;letter-spacing:0.3px;">{sn_display}</strong>'
-                f'&nbsp;&nbsp;<span style="font-weight:400;color:#1b1f2a;">{name_part}</span>'
-                f'</span>'
-            )
-        return name_part or sn_display
+        if sn_part and name_part:
+            return _MANPOWER_NAME_TMPL.format(sn=sn_part, name=name_part)
+        return name_part or (f"SN{sn_part}" if sn_part else "")
 
     # الموظفون الرئيسيون مجمّعون بالقسم
     # OrderedDict is already imported at module level
@@ -2002,7 +2428,7 @@ def _render_manpower_section(roster: dict, supervisor_display: str = "", import_
     # الأقسام التي تُعالج يدوياً — لا تُكرَّر في الـ loop أدناه
     MANUAL_DEPTS = {"supervisors"}
 
-    grouped_html = ""
+    dept_blocks: list[str] = []
     # أولاً: قسم Supervisors — يُعرض دائماً في الأعلى (مع استثناء EXCLUDED_SNS)
     sup_in_roster = [
         e for e in on_duty
@@ -2010,33 +2436,28 @@ def _render_manpower_section(roster: dict, supervisor_display: str = "", import_
         and str(e.get("sn","")).strip() not in ALL_SPECIAL_SNS
     ]
     if sup_in_roster:
-        sup_li_roster = "".join(f'<li contenteditable="true" style="outline:none;">{_fmt_name(e)}</li>\n' for e in sup_in_roster)
-        grouped_html += f"""
-      <div style="{dept_hdr}">Supervisors:</div>
-      <ul id="ul-supervisors" class="{ul_class}" style="{ul_style}">{sup_li_roster}</ul>
-      <button onclick="addListItem('ul-supervisors')" style="font-size:11px;padding:1px 8px;margin:2px 0 8px;cursor:pointer;background:#eef3fc;border:1px solid #0b3a78;color:#0b3a78;border-radius:3px;">+ Add</button>"""
+        sup_items = "".join(f'<li contenteditable="true" style="outline:none;">{_fmt_name(e)}</li>\n' for e in sup_in_roster)
     elif supervisor_display:
-        grouped_html += f"""
-      <div style="{dept_hdr}">Supervisors:</div>
-      <ul id="ul-supervisors" class="{ul_class}" style="{ul_style}"><li contenteditable="true" style="outline:none;"><strong>{supervisor_display}</strong></li></ul>
-      <button onclick="addListItem('ul-supervisors')" style="font-size:11px;padding:1px 8px;margin:2px 0 8px;cursor:pointer;background:#eef3fc;border:1px solid #0b3a78;color:#0b3a78;border-radius:3px;">+ Add</button>"""
+        sup_items = f'<li contenteditable="true" style="outline:none;"><strong>{supervisor_display}</strong></li>'
     else:
-        grouped_html += f"""
-      <div style="{dept_hdr}">Supervisors:</div>
-      <ul id="ul-supervisors" class="{ul_class}" style="{ul_style}"><li contenteditable="true" style="outline:none;">&nbsp;</li></ul>
-      <button onclick="addListItem('ul-supervisors')" style="font-size:11px;padding:1px 8px;margin:2px 0 8px;cursor:pointer;background:#eef3fc;border:1px solid #0b3a78;color:#0b3a78;border-radius:3px;">+ Add</button>"""
+        sup_items = '<li contenteditable="true" style="outline:none;">&nbsp;</li>'
+    dept_blocks.append(_MANPOWER_DEPT_TMPL.format(
+        dept_hdr=dept_hdr, title="Supervisors", ul_id="ul-supervisors",
+        ul_class=ul_class, ul_style=ul_style, items=sup_items,
+    ))
 
     # ثانياً: باقي الأقسام من roster (تخطّى supervisors — مُعالَج أعلاه)
     for dept, emps in by_dept.items():
         if dept.strip().lower() in MANUAL_DEPTS:
             continue
-        dept_id = "ul-dept-" + re.sub(r'[^a-z0-9]', '', dept.lower())
+        dept_id = "ul-dept-" + _DEPT_ID_BAD_RE.sub('', dept.lower())
         items_li = "".join(f'<li contenteditable="true" style="outline:none;">{_fmt_name(e)}</li>\n' for e in emps)
-        grouped_html += f"""
-      <div style="{dept_hdr}">{dept}:</div>
-      <ul id="{dept_id}" class="{ul_class}" style="{ul_style}">{items_li}</ul>
-      <button onclick="addListItem('{dept_id}')" style="font-size:11px;padding:1px 8px;margin:2px 0 8px;cursor:pointer;background:#eef3fc;border:1px solid #0b3a78;color:#0b3a78;border-radius:3px;">+ Add</button>"""
+        dept_blocks.append(_MANPOWER_DEPT_TMPL.format(
+            dept_hdr=dept_hdr, title=_html_escape(dept, quote=False), ul_id=dept_id,
+            ul_class=ul_class, ul_style=ul_style, items=items_li,
+        ))
 
+    grouped_html = "".join(dept_blocks)
     if not grouped_html:
         grouped_html = f'<ul class="{ul_class}" style="{ul_style}"><li style="color:#64748b;">No roster data available.</li></ul>'
 
@@ -2044,16 +2465,11 @@ def _render_manpower_section(roster: dict, supervisor_display: str = "", import_
     _inventory_from_roster = [e for e in on_duty if str(e.get("sn","")).strip() in INVENTORY_SNS]
 
     def _fmt_emp_row(name, sn):
-        sn = str(sn or "").strip()
-        name = str(name or "").strip()
-        sn_display = f"SN{sn}" if sn else ""
+        sn = _html_escape(str(sn or "").strip())
+        name = _html_escape(str(name or "").strip())
         content = (
-            f'<span data-sn="{sn}" data-name="{name}" '
-            f'style="font-family:Calibri,Arial,sans-serif;color:#1b1f2a;white-space:nowrap;">'
-            f'<strong style="font-weight:700;color:#1b1f2a;letter-spacing:0.3px;">{sn_display}</strong>'
-            f'&nbsp;&nbsp;<span style="font-weight:400;color:#1b1f2a;">{name}</span>'
-            f'</span>'
-            if sn_display and name else (name or sn_display)
+            _MANPOWER_NAME_TMPL.format(sn=sn, name=name)
+            if sn and name else (name or (f"SN{sn}" if sn else ""))
         )
         return f'<li contenteditable="true" style="outline:none;">{content}</li>'
 
@@ -2173,7 +2589,7 @@ def _load_manpower_json_staff_map() -> dict[str, str]:
     if not path.exists():
         return {}
     try:
-        data = json.loads(path.read_text(encoding="utf-8"))
+        data = read_json(path)
     except Exception as exc:
         print(f"  [manpower.json] Failed to load {path}: {exc}")
         return {}
@@ -2185,7 +2601,7 @@ def _load_manpower_json_staff_map() -> dict[str, str]:
             name = str(node.get("name", "")).strip()
             emp_id = str(node.get("id", "")).strip()
             if name and emp_id:
-                m = re.search(r"(\d{3,10})", emp_id)
+                m = _EMP_ID_DIGITS_RE.search(emp_id)
                 if m:
                     sn = m.group(1)
                     out.setdefault(sn, name)
@@ -2199,31 +2615,46 @@ def _load_manpower_json_staff_map() -> dict[str, str]:
     print(f"  [manpower.json] Loaded {len(out)} staff IDs from {path}")
     return out
 
-def _update_flight_json(folder: Path, flight: dict) -> None:
-    """Update a saved flight JSON file with new data (e.g. enriched STD/ETD)."""
+def _update_flight_json(folder: Path, flight: dict, pending: dict[Path, object]) -> None:
+    """Merge new data (e.g. enriched STD/ETD) into a saved flight JSON file.
+    الكتابة نفسها تُؤجَّل إلى pending لتُكتب كل الملفات معاً عبر _write_json_many."""
     filename = slugify(
         f"{flight['flight']}_{flight.get('date','')}_{flight.get('destination','')}"
     ) + ".json"
     file_path = folder / filename
     if file_path.exists():
         try:
-            existing = json.loads(file_path.read_text(encoding="utf-8"))
+            existing = pending.get(file_path) or read_json(file_path)
             # السماح بتحديث الحقول بقيم فارغة، مع حماية المفاتيح الأساسية
             _protected = {"flight", "date", "items"}
             existing.update({k: v for k, v in flight.items() if k not in _protected or v})
-            file_path.write_text(json.dumps(existing, ensure_ascii=False, indent=2), encoding="utf-8")
+            pending[file_path] = existing
         except Exception:
             pass
 
 
+# ── ثوابت المناوبات للعرض (تُبنى مرة واحدة بدل dict جديد في كل استدعاء) ──
+_REPORT_SHIFT_LABELS = {
+    "shift1": {"ar": "صباح",     "en": "Morning",   "time": "06:00 – 15:00"},
+    "shift2": {"ar": "ظهر/مساء", "en": "Afternoon", "time": "13:00 – 22:00"},
+    "shift3": {"ar": "ليل",      "en": "Night",      "time": "21:00 – 06:00"},
+}
+
+
 def build_shift_report(date_dir: str, shift: str) -> None:
     folder = DATA_DIR / date_dir / shift
     if not folder.exists():
         return
 
+    # الروستر (Export + Import) لا يعتمد على الرحلات — يُجلب بالتوازي أثناء الإثراء
+    roster_pool = ThreadPoolExecutor(max_workers=2)
+    roster_future = roster_pool.submit(fetch_roster_staff, date_dir, shift)
+    import_roster_future = roster_pool.submit(fetch_import_flight_dispatch_staff, date_dir, shift)
+    roster_pool.shutdown(wait=False)
+
     meta         = load_json(folder / "meta.json", {"flights": {}})
-    flight_files = sorted(p for p in folder.glob("*.json") if p.name != "meta.json")
-    flights      = [json.loads(p.read_text(encoding="utf-8")) for p in flight_files]
+    flight_files = _flight_json_files(folder)
+    flights      = [read_json(p) for p in flight_files]
 
     # ── Filter offload: only keep flights whose date matches the report date ──
     # datetime is already imported at module level
@@ -2231,7 +2662,7 @@ def build_shift_report(date_dir: str, shift: str) -> None:
         """Strictly keep only flights whose parsed date equals report_date."""
         if not flt_date_str or not flt_date_str.strip():
             return False
-        parsed = normalize_flight_date(flt_date_str, datetime.now(ZoneInfo(TIMEZONE)))
+        parsed = normalize_flight_date(flt_date_str, datetime.now(LOCAL_TZ))
         if not parsed:
             return False
         return parsed == report_date
@@ -2240,6 +2671,7 @@ def build_shift_report(date_dir: str, shift: str) -> None:
 
     # ── Enrich STD/ETD + DEST — always re-evaluate with confidence scoring ──
     enriched_count = 0
+    enriched_writes: dict[Path, object] = {}
     for f in flights:
         flt = normalize_flight_number(f.get("flight") or "")
         if not flt:
@@ -2248,7 +2680,7 @@ def build_shift_report(date_dir: str, shift: str) -> None:
         try:
             info, source_name = fetch_flight_info_with_fallbacks(
                 flt,
-                flight_date=normalize_flight_date(f.get("date", ""), datetime.now(ZoneInfo(TIMEZONE))) or date_dir,
+                flight_date=normalize_flight_date(f.get("date", ""), datetime.now(LOCAL_TZ)) or date_dir,
                 dep_iata="MCT",
                 arr_iata=(f.get("destination") or "").strip() or None,
             )
@@ -2280,7 +2712,7 @@ def build_shift_report(date_dir: str, shift: str) -> None:
                 old = current_std_etd
                 f["std_etd"] = new_std_etd
                 f["enrichment_source"] = source_name
-                f["last_enriched"] = datetime.now(ZoneInfo(TIMEZONE)).isoformat()
+                f["last_enriched"] = datetime.now(LOCAL_TZ).isoformat()
                 changed = True
                 print(f"  [CORRECTION] {flt} STD/ETD: {old!r} -> {new_std_etd!r} via {source_name}")
 
@@ -2291,38 +2723,44 @@ def build_shift_report(date_dir: str, shift: str) -> None:
 
             if changed:
                 enriched_count += 1
-                _update_flight_json(folder, f)
+                _update_flight_json(folder, f, enriched_writes)
 
         except Exception as exc:
             print(f"  [report-enrich] {flt}: {exc}")
 
+    try:
+        _write_json_many(enriched_writes)
+    except Exception as exc:
+        print(f"  [report-enrich] Failed to save enriched flights: {exc}")
+
     print(f"Enriched {enriched_count} flight(s) via confidence-scored fallback chain.")
 
-    shift_labels = {
-        "shift1": {"ar": "صباح",     "en": "Morning",   "time": "06:00 – 15:00"},
-        "shift2": {"ar": "ظهر/مساء", "en": "Afternoon", "time": "13:00 – 22:00"},
-        "shift3": {"ar": "ليل",      "en": "Night",      "time": "21:00 – 06:00"},
-    }
-    sl            = shift_labels.get(shift, {"ar": shift, "en": shift, "time": ""})
+    sl            = _REPORT_SHIFT_LABELS.get(shift, {"ar": shift, "en": shift, "time": ""})
     sl_en         = sl["en"]
     sl_time       = sl["time"]
     shift_label   = f"{sl_en} Shift — {sl_time}"
     total_flights = len(flights)
-    total_items   = sum(len(f.get("items", [])) for f in flights)
+
+    # تمريرة واحدة: عدد الشحنات + أسماء الرحلات (dict يحفظ الترتيب — set كان يغيّره بين التشغيلات)
+    total_items = 0
+    flt_names: dict[str, None] = {}
+    for f in flights:
+        total_items += len(f.get("items", []))
+        if f.get("flight", ""):
+            flt_names[f["flight"]] = None
 
     # Build offload table (Section 4)
     offload_table_html = _render_offload_table(flights, meta)
 
     # Offload summary text for Shift Summary card
-    flt_names = list({f.get("flight","") for f in flights if f.get("flight","")})
     if total_items:
         offload_summary = f"{total_items} offloaded shipment{'s' if total_items!=1 else ''} across {len(flt_names)} flight{'s' if len(flt_names)!=1 else ''} ({', '.join(flt_names)})."
     else:
         offload_summary = "NIL"
 
     # Fetch roster
-    roster = fetch_roster_staff(date_dir, shift)
-    import_roster = fetch_import_flight_dispatch_staff(date_dir, shift)
+    roster = roster_future.result()
+    import_roster = import_roster_future.result()
 
     # ── Supervisor name resolution (on-duty only) ──
     # Only use actual supervisors from roster — no acting/deputy logic.
@@ -2342,7 +2780,8 @@ def build_shift_report(date_dir: str, shift: str) -> None:
                 break
 
     # Empty = leave blank (no acting supervisor)
-    supervisor_display = supervisor_name if supervisor_name else ""
+    # يُهرَّب مرة واحدة — يظهر في قسم Manpower وفي التوقيع
+    supervisor_display = _html_escape(supervisor_name, quote=False) if supervisor_name else ""
     signature_display = supervisor_display
 
     manpower_cols = _render_manpower_section(roster, supervisor_display, import_roster)
@@ -2359,8 +2798,8 @@ def build_shift_report(date_dir: str, shift: str) -> None:
     except Exception:
         date_display = date_dir
 
-    # ── تجهيز JSON للرحلات المحلية كمتغير خارج الـ f-string ──
-    local_flights_js = json.dumps(_load_local_db(), ensure_ascii=False)
+    # ── تجهيز JSON للرحلات المحلية كمتغير خارج الـ f-string (نفس النص لكل التقارير) ──
+    local_flights_js = _local_flights_js()
 
     # ── تجهيز JSON لكل الموظفين لاستخدامه في autocomplete ──
     _staff_map: dict[str, str] = _load_manpower_json_staff_map()
@@ -2374,7 +2813,7 @@ def build_shift_report(date_dir: str, shift: str) -> None:
         _nm = str(_emp.get("name", "")).strip()
         if _sn and _nm and _sn not in _staff_map:
             _staff_map[_sn] = _nm
-    all_staff_js = json.dumps(_staff_map, ensure_ascii=False)
+    all_staff_js = dumps_json(_staff_map)
 
     html = f"""<!DOCTYPE html>
 <html xmlns:v="urn:schemas-microsoft-com:vml" xmlns:o="urn:schemas-microsoft-com:office:office">
@@ -4511,7 +4950,7 @@ window._ALL_STAFF          = {all_staff_js};
 
     out_dir = DOCS_DIR / date_dir / shift
     out_dir.mkdir(parents=True, exist_ok=True)
-    (out_dir / "index.html").write_text(html, encoding="utf-8")
+    write_text_if_changed(out_dir / "index.html", html)
 
 
 
@@ -4529,13 +4968,69 @@ def build_nil_shift_report(date_dir: str, shift: str, now) -> None:
     if not meta_file.exists():
         meta_file.write_text("{}", encoding="utf-8")
     # إذا يوجد رحلات حقيقية — اترك build_shift_report يتعامل معها
-    real_flights = [p for p in data_folder.glob("*.json") if p.name != "meta.json"]
+    real_flights = _flight_json_files(data_folder)
     if real_flights:
         return
     # ابنِ تقرير NIL باستخدام نفس build_shift_report
     build_shift_report(date_dir, shift)
     print(f"  [NIL report] Built: {date_dir}/{shift}")
 
+# ── بطاقة المناوبة في الصفحة الرئيسية (badge = عدد الرحلات / NIL / فارغ) ──
+_SHIFT_CARD_TMPL = """
+            <a class="shift-card" href="{day}/{shift}/">
+                <div class="sc-icon">{icon}</div>
+                <div class="sc-body">
+                    <div class="sc-title">{ar} <span class="sc-en">/ {label}</span></div>
+                    <div class="sc-time">{time}</div>
+                </div>
+                <div class="sc-right">
+                    {badge}
+                    <span class="sc-arrow">›</span>
+                </div>
+            </a>"""
+_SHIFT_CARD_NIL_BADGE = '<span style="font-size:11px;color:#94a3b8;font-weight:600;">NIL</span>'
+
+# ── بطاقة اليوم (accordion) — قالب ثابت مثل بطاقة المناوبة ──
+_DAY_BLOCK_TMPL = """
+        <details class="day-accordion"{open_attr}>
+            <summary class="day-summary">
+                <div class="day-sum-left">
+                    <span class="day-date">📅 {day}</span>
+                    {badge}
+                    {flights_pill}
+                </div>
+                <span class="day-chev">›</span>
+            </summary>
+            <div class="day-body">
+                {rows}
+            </div>
+        </details>"""
+_DAY_TODAY_BADGE    = '<span class="today-badge">TODAY</span>'
+_DAY_UPCOMING_BADGE = '<span class="today-badge" style="background:#64748b;">UPCOMING</span>'
+
+
+_ROOT_SHIFT_META = {
+    "shift1": {"label": "Morning",   "ar": "صباح", "time": "06:00 – 15:00", "icon": "🌅"},
+    "shift2": {"label": "Afternoon", "ar": "ظهر",  "time": "13:00 – 22:00", "icon": "☀️"},
+    "shift3": {"label": "Night",     "ar": "ليل",  "time": "21:00 – 06:00", "icon": "🌙"},
+}
+
+
+@lru_cache(maxsize=2048)
+def _flight_date_in_report(fd: str, report_date: str) -> bool:
+    """هل تاريخ الرحلة (كما في JSON) هو يوم التقرير؟ الصيغ غير المعروفة تُحسب."""
+    rd = datetime.strptime(report_date, "%Y-%m-%d")
+    for fmt in ("%d%b%y", "%d%b%Y", "%d%b", "%Y-%m-%d", "%d-%b-%y", "%d-%b-%Y"):
+        try:
+            parsed = datetime.strptime(fd, fmt)
+            if fmt == "%d%b":
+                parsed = parsed.replace(year=rd.year)
+            return parsed.day == rd.day and parsed.month == rd.month and parsed.year == rd.year
+        except ValueError:
+            continue
+    return True  # unknown format = count it
+
+
 def build_root_index(now: datetime) -> None:
     """Modern home page with accordion days; current day opened by default.
     Always shows all days of current month even with no offload data."""
@@ -4552,139 +5047,82 @@ def build_root_index(now: datetime) -> None:
         for d in range(1, now.day + 1)  # من أول الشهر حتى اليوم فقط
     }
     # أيام محفوظة من أشهر أخرى (أقدم من الشهر الحالي)
-    _saved_days: set = set()
-    if DATA_DIR.exists():
-        for _p in DATA_DIR.iterdir():
-            if _p.is_dir() and re.match(r"\d{4}-\d{2}-\d{2}", _p.name):
-                if _p.name < f"{now.year:04d}-{now.month:02d}-01":
-                    _saved_days.add(_p.name)
+    _month_start = f"{now.year:04d}-{now.month:02d}-01"
+    _saved_days: set = {
+        name for name in _subdir_names(DATA_DIR)
+        if _DATE_DIR_RE.match(name) and name < _month_start
+    }
 
     day_dirs = sorted(_month_days | _saved_days, reverse=True)
 
-    shift_meta = {
-        "shift1": {"label": "Morning",   "ar": "صباح", "time": "06:00 – 15:00", "icon": "🌅"},
-        "shift2": {"label": "Afternoon", "ar": "ظهر",  "time": "13:00 – 22:00", "icon": "☀️"},
-        "shift3": {"label": "Night",     "ar": "ليل",  "time": "21:00 – 06:00", "icon": "🌙"},
-    }
-
     total_days = len(day_dirs)
 
-    # بناء/تحديث تقارير لكل الأيام والمناوبات
+    # بناء/تحديث تقارير NIL لكل الأيام والمناوبات (الأيام التي فيها رحلات تُترك كما هي).
+    # build_nil_shift_report يعيد البناء دائماً، و write_text_if_changed لا يلمس الصفحة إن لم تتغير
     for day in day_dirs:
         for shift in ("shift1", "shift2", "shift3"):
-            # احذف التقرير القديم إذا لم تكن هناك رحلات حقيقية (لإجبار إعادة البناء)
-            real = list((DATA_DIR / day / shift).glob("*.json")) if (DATA_DIR / day / shift).exists() else []
-            real = [p for p in real if p.name != "meta.json"]
-            if not real:
-                old_report = DOCS_DIR / day / shift / "index.html"
-                if old_report.exists():
-                    old_report.unlink()
             build_nil_shift_report(day, shift, now)
 
     # عد الرحلات (مع تطبيق فلتر التاريخ كما في التقرير)
     def _count_matching_flights(folder: Path, report_date: str) -> int:
         """Count JSON flight files whose date matches the report date."""
-        if not folder.exists():
-            return 0
         count = 0
-        for p in folder.glob("*.json"):
-            if p.name == "meta.json":
-                continue
+        for p in _flight_json_files(folder):
             try:
-                flt = json.loads(p.read_text(encoding="utf-8"))
+                flt = read_json(p)
                 fd = (flt.get("date") or "").strip().upper()
                 if not fd:
                     count += 1  # no date = count it
                     continue
-                # datetime is already imported at module level
-                rd = datetime.strptime(report_date, "%Y-%m-%d")
-                matched = False
-                for fmt in ("%d%b%y", "%d%b%Y", "%d%b", "%Y-%m-%d", "%d-%b-%y", "%d-%b-%Y"):
-                    try:
-                        parsed = datetime.strptime(fd, fmt)
-                        if fmt == "%d%b":
-                            parsed = parsed.replace(year=rd.year)
-                        if parsed.day == rd.day and parsed.month == rd.month and parsed.year == rd.year:
-                            matched = True
-                        break
-                    except ValueError:
-                        continue
-                else:
-                    matched = True  # unknown format = count it
-                if matched:
+                if _flight_date_in_report(fd, report_date):
                     count += 1
             except Exception:
                 count += 1
         return count
 
-    days_html = ""
+    day_blocks: list[str] = []
     for day in day_dirs:
         is_today   = day == today
         is_future  = day > today
         open_attr  = " open" if is_today else ""
 
-        day_flights = 0
-        for shift in ("shift1", "shift2", "shift3"):
-            day_flights += _count_matching_flights(DATA_DIR / day / shift, day)
+        # عدّ كل مناوبة مرة واحدة فقط (يُستخدم للمجموع ولبطاقات المناوبات)
+        shift_counts = {
+            shift: _count_matching_flights(DATA_DIR / day / shift, day)
+            for shift in ("shift1", "shift2", "shift3")
+        }
+        day_flights = sum(shift_counts.values())
 
-        badge        = '<span class="today-badge">TODAY</span>' if is_today else ('<span class="today-badge" style="background:#64748b;">UPCOMING</span>' if is_future else "")
+        badge        = _DAY_TODAY_BADGE if is_today else (_DAY_UPCOMING_BADGE if is_future else "")
         flights_pill = f'<span class="day-pill">{day_flights} flights</span>' if day_flights else ""
 
-        rows = ""
+        shift_cards: list[str] = []
         for shift in ("shift1", "shift2", "shift3"):
             shift_report = DOCS_DIR / day / shift / "index.html"
-            meta_s = shift_meta.get(shift, {"label": shift, "ar": shift, "time": "", "icon": "✈"})
+            meta_s = _ROOT_SHIFT_META.get(shift, {"label": shift, "ar": shift, "time": "", "icon": "✈"})
             ms_icon  = meta_s["icon"]
             ms_ar    = meta_s["ar"]
             ms_label = meta_s["label"]
             ms_time  = meta_s["time"]
-            shift_flt_count = _count_matching_flights(DATA_DIR / day / shift, day)
+            shift_flt_count = shift_counts[shift]
             flt_txt = f"{shift_flt_count} flight{'s' if shift_flt_count != 1 else ''}" if shift_flt_count else ""
 
             if shift_report.exists():
                 # مناوبة فيها تقرير — رابط
-                rows += f"""
-            <a class="shift-card" href="{day}/{shift}/">
-                <div class="sc-icon">{ms_icon}</div>
-                <div class="sc-body">
-                    <div class="sc-title">{ms_ar} <span class="sc-en">/ {ms_label}</span></div>
-                    <div class="sc-time">{ms_time}</div>
-                </div>
-                <div class="sc-right">
-                    {f'<span class="sc-count">{flt_txt}</span>' if flt_txt else ''}
-                    <span class="sc-arrow">›</span>
-                </div>
-            </a>"""
+                sc_badge = f'<span class="sc-count">{flt_txt}</span>' if flt_txt else ''
             else:
                 # مناوبة NIL — رابط قابل للضغط
-                rows += f"""
-            <a class="shift-card" href="{day}/{shift}/">
-                <div class="sc-icon">{ms_icon}</div>
-                <div class="sc-body">
-                    <div class="sc-title">{ms_ar} <span class="sc-en">/ {ms_label}</span></div>
-                    <div class="sc-time">{ms_time}</div>
-                </div>
-                <div class="sc-right">
-                    <span style="font-size:11px;color:#94a3b8;font-weight:600;">NIL</span>
-                    <span class="sc-arrow">›</span>
-                </div>
-            </a>"""
-
-        days_html += f"""
-        <details class="day-accordion"{open_attr}>
-            <summary class="day-summary">
-                <div class="day-sum-left">
-                    <span class="day-date">📅 {day}</span>
-                    {badge}
-                    {flights_pill}
-                </div>
-                <span class="day-chev">›</span>
-            </summary>
-            <div class="day-body">
-                {rows}
-            </div>
-        </details>"""
-
+                sc_badge = _SHIFT_CARD_NIL_BADGE
+            shift_cards.append(_SHIFT_CARD_TMPL.format(
+                day=day, shift=shift, icon=ms_icon, ar=ms_ar, label=ms_label,
+                time=ms_time, badge=sc_badge,
+            ))
+        day_blocks.append(_DAY_BLOCK_TMPL.format(
+            open_attr=open_attr, day=day, badge=badge, flights_pill=flights_pill,
+            rows="".join(shift_cards),
+        ))
+
+    days_html = "".join(day_blocks)
     if not days_html:
         days_html = "<div class='empty-day' style='text-align:center;padding:48px'>لا توجد تقارير بعد.</div>"
 
@@ -5199,7 +5637,7 @@ function copyManpower() {{
 </body>
 </html>"""
 
-    (DOCS_DIR / "index.html").write_text(html, encoding="utf-8")
+    write_text_if_changed(DOCS_DIR / "index.html", html)
 
 
 # ══════════════════════════════════════════════════════════════════
@@ -5225,16 +5663,21 @@ def retroactive_enrich_all(now: datetime) -> None:
     updated_count = 0
     skipped_count = 0
     failed_count = 0
+    pending_writes: dict[Path, object] = {}
 
     for json_file in sorted(DATA_DIR.rglob("*.json")):
-        if json_file.name == "meta.json":
+        # meta.json وملفات الحالة المخفية (.xxx.json) ليست ملفات رحلات
+        if json_file.name == "meta.json" or json_file.name.startswith("."):
             continue
 
         try:
-            flight = json.loads(json_file.read_text(encoding="utf-8"))
+            flight = read_json(json_file)
         except Exception:
             failed_count += 1
             continue
+        if not isinstance(flight, dict):
+            skipped_count += 1
+            continue
 
         flt = normalize_flight_number((flight.get("flight") or "").strip())
         raw_date = (flight.get("date") or "").strip()
@@ -5283,16 +5726,17 @@ def retroactive_enrich_all(now: datetime) -> None:
         if changed:
             flight["retro_enriched_at"] = now.isoformat()
             flight["retro_enriched_source"] = source_name or ""
-            json_file.write_text(json.dumps(flight, ensure_ascii=False, indent=2), encoding="utf-8")
+            pending_writes[json_file] = flight
             updated_count += 1
         else:
             skipped_count += 1
 
+    _write_json_many(pending_writes)
     print(f"[retroactive] Done. Updated: {updated_count}, Skipped/unchanged: {skipped_count}, Failed: {failed_count}")
 
     print("[retroactive] Rebuilding HTML reports…")
     rebuilt = 0
-    for date_dir_p in sorted(p for p in DATA_DIR.iterdir() if p.is_dir()):
+    for date_dir_p in map(DATA_DIR.joinpath, _subdir_names(DATA_DIR)):
         for shift in ("shift1", "shift2", "shift3"):
             if (date_dir_p / shift).exists():
                 build_shift_report(date_dir_p.name, shift)
@@ -5306,6 +5750,14 @@ def retroactive_enrich_all(now: datetime) -> None:
 #  إرسال التقرير بالبريد الإلكتروني
 # ══════════════════════════════════════════════════════════════════
 
+# مسح واحد بدل ثلاث تمريرات re.sub على كامل صفحة التقرير
+_EMAIL_STRIP_ATTRS_RE = re.compile(r'\s+(?:contenteditable|tabindex|class)="[^"]*"')
+_REPORT_TABLE_START_RE = re.compile(r'<table[^>]*id="report-content"[^>]*>', re.IGNORECASE)
+# فتح أو إغلاق جدول في نمط واحد — group(1) موجودة فقط للإغلاق
+_TABLE_TAG_RE = re.compile(r'<table[\s>]|(</table\s*>)', re.IGNORECASE)
+_BACK_LINK_ROW_RE = re.compile(r'<tr[^>]*id="back-link-row"[^>]*>.*?</tr>', re.DOTALL | re.IGNORECASE)
+
+
 def _extract_report_content_html(page_html: str) -> str:
     """Return only the main report container without action buttons/scripts.
     Uses regex-based extraction to preserve nested table structure (avoids
@@ -5315,63 +5767,44 @@ def _extract_report_content_html(page_html: str) -> str:
     """
     # ── 1) Extract report-content table via regex (preserves nesting) ──
     # Find the opening tag with id="report-content"
-    m_start = re.search(r'<table[^>]*id="report-content"[^>]*>', page_html, re.IGNORECASE)
+    m_start = _REPORT_TABLE_START_RE.search(page_html)
     if not m_start:
         html = page_html
     else:
         start = m_start.start()
-        # Walk forward counting <table> / </table> to find matching close
+        # Walk forward counting <table> / </table> to find matching close —
+        # مسح واحد بـ finditer من موضع البداية بدل قص page_html[pos:] مرتين لكل وسم
         depth = 0
-        pos = start
-        while pos < len(page_html):
-            t_open  = re.search(r'<table[\s>]', page_html[pos:], re.IGNORECASE)
-            t_close = re.search(r'</table\s*>', page_html[pos:], re.IGNORECASE)
-            if t_close is None:
-                break
-            if t_open and t_open.start() < t_close.start():
+        pos = start  # نهاية آخر </table> (الملف المقطوع يُقص عندها)
+        for tag in _TABLE_TAG_RE.finditer(page_html, start):
+            if tag.group(1) is None:
                 depth += 1
-                pos += t_open.start() + 1
-            else:
-                depth -= 1
-                pos += t_close.end()
-                if depth == 0:
-                    break
+                continue
+            depth -= 1
+            pos = tag.end()
+            if depth == 0:
+                break
         html = page_html[start:pos]
 
     # ── 2) Remove Back-to-Index link row ──
-    html = re.sub(
-        r'<tr[^>]*id="back-link-row"[^>]*>.*?</tr>',
-        '',
-        html,
-        flags=re.DOTALL | re.IGNORECASE,
-    )
+    html = _BACK_LINK_ROW_RE.sub('', html)
 
     # ── 3) Strip attributes invalid in email clients ──
-    html = re.sub(r'\s+contenteditable="[^"]*"', '', html)
-    html = re.sub(r'\s+tabindex="[^"]*"', '', html)
-    html = re.sub(r'\s+class="[^"]*"', '', html)
+    html = _EMAIL_STRIP_ATTRS_RE.sub('', html)
 
     return html
 
 
-def _build_email_html(page_html: str) -> str:
-    """Build a mobile-friendly HTML email — left-aligned, no centering."""
-    report_html = _extract_report_content_html(page_html)
-    # Make the report table full-width regardless of inline width/max-width
-    report_html = re.sub(r'width="(760|1100)"', 'width="100%"', report_html)
-    report_html = re.sub(
-        r'style="width:(760|1100)px;[^"]*"',
-        'style="width:100%; max-width:100%; background-color:#ffffff; border:none;"',
-        report_html,
-    )
-
-    return f"""<!doctype html>
+# غلاف الإيميل ثابت — يُبنى مرة واحدة عند التحميل، ويُلصق حوله محتوى التقرير فقط
+_EMAIL_WIDTH_ATTR_RE  = re.compile(r'width="(760|1100)"')
+_EMAIL_WIDTH_STYLE_RE = re.compile(r'style="width:(760|1100)px;[^"]*"')
+_EMAIL_HTML_HEAD = """<!doctype html>
 <html dir="ltr">
 <head>
   <meta charset="utf-8">
   <meta name="viewport" content="width=device-width, initial-scale=1.0">
   <style>
-    html, body {{
+    html, body {
       margin: 0 !important;
       padding: 0 !important;
       width: 100% !important;
@@ -5379,26 +5812,26 @@ def _build_email_html(page_html: str) -> str:
       font-family: Calibri, Arial, sans-serif !important;
       -webkit-text-size-adjust: 100%;
       -ms-text-size-adjust: 100%;
-    }}
-    body, table, td, div, p, a, li {{
+    }
+    body, table, td, div, p, a, li {
       font-size: 15px !important;
       line-height: 1.55 !important;
-    }}
-    table {{ border-collapse: collapse; }}
-    img {{ border: 0; display: block; max-width: 100%; height: auto; }}
-    .mobile-wrap {{ width: 100%; padding: 8px 12px 18px; box-sizing: border-box; }}
-    @media only screen and (max-width: 640px) {{
-      body, table, td, div, p, a, li {{
+    }
+    table { border-collapse: collapse; }
+    img { border: 0; display: block; max-width: 100%; height: auto; }
+    .mobile-wrap { width: 100%; padding: 8px 12px 18px; box-sizing: border-box; }
+    @media only screen and (max-width: 640px) {
+      body, table, td, div, p, a, li {
         font-size: 16px !important;
         line-height: 1.65 !important;
-      }}
-      .mobile-wrap {{ padding: 4px 6px 14px !important; }}
-      table[width="100%"] {{ width: 100% !important; }}
-      td[style*="font-size:20px"] div {{ font-size: 18px !important; }}
-      td[style*="font-size:13.5px"], div[style*="font-size:13.5px"], span[style*="font-size:12px"], td[style*="font-size:12px"] {{
+      }
+      .mobile-wrap { padding: 4px 6px 14px !important; }
+      table[width="100%"] { width: 100% !important; }
+      td[style*="font-size:20px"] div { font-size: 18px !important; }
+      td[style*="font-size:13.5px"], div[style*="font-size:13.5px"], span[style*="font-size:12px"], td[style*="font-size:12px"] {
         font-size: 15px !important;
-      }}
-    }}
+      }
+    }
   </style>
 </head>
 <body>
@@ -5406,7 +5839,8 @@ def _build_email_html(page_html: str) -> str:
     <table width="100%" cellpadding="0" cellspacing="0" border="0" role="presentation" style="width:100%; background:#ffffff;">
       <tr>
         <td align="left" style="padding:0;">
-          {report_html}
+          """
+_EMAIL_HTML_TAIL = """
         </td>
       </tr>
     </table>
@@ -5415,11 +5849,93 @@ def _build_email_html(page_html: str) -> str:
 </html>"""
 
 
+def _build_email_html(page_html: str) -> str:
+    """Build a mobile-friendly HTML email — left-aligned, no centering."""
+    report_html = _extract_report_content_html(page_html)
+    # Make the report table full-width regardless of inline width/max-width
+    report_html = _EMAIL_WIDTH_ATTR_RE.sub('width="100%"', report_html)
+    report_html = _EMAIL_WIDTH_STYLE_RE.sub(
+        'style="width:100%; max-width:100%; background-color:#ffffff; border:none;"',
+        report_html,
+    )
+
+    return _EMAIL_HTML_HEAD + report_html + _EMAIL_HTML_TAIL
+
+
+# اتصال SMTP واحد يُعاد استخدامه لكل الإيميلات في نفس التشغيل
+# (TLS + LOGIN مرة واحدة بدل مرة لكل إيميل)
+_smtp_server = None
+
+
+def _get_smtp_server(smtp_user: str, smtp_password: str):
+    """Return a logged-in SMTP_SSL connection, reusing the open one if still alive."""
+    global _smtp_server
+    import smtplib
+
+    if _smtp_server is not None:
+        try:
+            _smtp_server.noop()
+            return _smtp_server
+        except (smtplib.SMTPException, OSError):
+            # OSError يشمل ssl.SSLError ومقبس TLS مقطوع — لا QUIT على اتصال ميت، نغلقه ونعيد الاتصال
+            try:
+                _smtp_server.close()
+            except Exception:
+                pass
+            _smtp_server = None
+
+    server = smtplib.SMTP_SSL("smtp.gmail.com", 465)
+    server.login(smtp_user, smtp_password)
+    _smtp_server = server
+    return server
+
+
+def close_smtp_server() -> None:
+    """إغلاق اتصال SMTP المشترك إذا كان مفتوحاً."""
+    global _smtp_server
+    if _smtp_server is None:
+        return
+    try:
+        _smtp_server.quit()
+    except Exception:
+        pass
+    _smtp_server = None
+
+
+_EMAIL_SHIFT_NAMES = {
+    "shift1": "Morning Shift (06:00–15:00)",
+    "shift2": "Afternoon Shift (15:00–22:00)",
+    "shift3": "Night Shift (22:00–06:00)",
+}
+
+
+def _build_email_wire(smtp_user: str, recipients: list[str], subject: str,
+                      date_dir: str, shift: str, html_content: str) -> bytes:
+    """تسلسل إيميل التقرير مرة واحدة إلى bytes جاهزة لـ sendmail (أسطر CRLF)."""
+    from email.message import EmailMessage
+    from email.policy import SMTP as _SMTP_POLICY
+
+    # EmailMessage: نص + HTML كبديلين، quoted-printable بدل base64 (HTML أغلبه ASCII
+    # فيخرج أصغر بحوالي الربع)
+    msg = EmailMessage()
+    msg["Subject"] = subject
+    msg["From"]    = smtp_user
+    msg["To"]      = ", ".join(recipients)
+    plain_text = f"""Export Warehouse Activity Report
+Date: {date_dir}
+Shift: {_EMAIL_SHIFT_NAMES.get(shift, shift)}
+"""
+    msg.set_content(plain_text, cte="quoted-printable")
+    msg.add_alternative(html_content, subtype="html", cte="quoted-printable")
+
+    # sendmail يرسل الـ bytes كما هي بدون تحويل نهايات الأسطر، وسياسة
+    # EmailMessage الافتراضية تكتب \n فقط — لذا نسلسل بسياسة SMTP (CRLF)
+    return msg.as_bytes(policy=_SMTP_POLICY)
+
+
 def send_shift_report_email(date_dir: str, shift: str) -> None:
     """إرسال تقرير المناوبة بالبريد الإلكتروني كـ HTML كامل."""
     import smtplib
-    from email.mime.multipart import MIMEMultipart
-    from email.mime.text import MIMEText
 
     smtp_user      = os.environ.get("EMAIL_SENDER", "").strip()
     smtp_password  = os.environ.get("EMAIL_APP_PASSWORD", "").strip()
@@ -5429,7 +5945,7 @@ def send_shift_report_email(date_dir: str, shift: str) -> None:
     event_path = os.environ.get("GITHUB_EVENT_PATH", "").strip()
     if event_path and Path(event_path).exists():
         try:
-            event_data = json.loads(Path(event_path).read_text(encoding="utf-8"))
+            event_data = read_json(Path(event_path))
             payload = event_data.get("client_payload") or {}
             payload_recipients = payload.get("recipients") or []
             if isinstance(payload_recipients, list):
@@ -5452,28 +5968,18 @@ def send_shift_report_email(date_dir: str, shift: str) -> None:
     page_html = report_file.read_text(encoding="utf-8")
     html_content = _build_email_html(page_html)
 
-    shift_names = {
-        "shift1": "Morning Shift (06:00–15:00)",
-        "shift2": "Afternoon Shift (15:00–22:00)",
-        "shift3": "Night Shift (22:00–06:00)",
-    }
-    subject = f"Export Warehouse Activity Report — {date_dir} | {shift_names.get(shift, shift)}"
-
-    msg = MIMEMultipart("alternative")
-    msg["Subject"] = subject
-    msg["From"]    = smtp_user
-    msg["To"]      = ", ".join(recipients)
-    plain_text = f"""Export Warehouse Activity Report
-Date: {date_dir}
-Shift: {shift_names.get(shift, shift)}
-"""
-    msg.attach(MIMEText(plain_text, "plain", "utf-8"))
-    msg.attach(MIMEText(html_content, "html", "utf-8"))
+    subject = f"Export Warehouse Activity Report — {date_dir} | {_EMAIL_SHIFT_NAMES.get(shift, shift)}"
 
+    wire = _build_email_wire(smtp_user, recipients, subject, date_dir, shift, html_content)
     try:
-        with smtplib.SMTP_SSL("smtp.gmail.com", 465) as server:
-            server.login(smtp_user, smtp_password)
-            server.sendmail(smtp_user, recipients, msg.as_string())
+        try:
+            server = _get_smtp_server(smtp_user, smtp_password)
+            server.sendmail(smtp_user, recipients, wire)
+        except smtplib.SMTPServerDisconnected:
+            # انقطع الاتصال بين الـ NOOP والإرسال — نعيد الاتصال مرة واحدة
+            close_smtp_server()
+            server = _get_smtp_server(smtp_user, smtp_password)
+            server.sendmail(smtp_user, recipients, wire)
         print(f"  [email] Sent: {subject} → {recipients}")
     except Exception as exc:
         print(f"  [email] ERROR: {exc}")
@@ -5487,6 +5993,14 @@ def _email_sent_key(date_dir: str, shift: str) -> Path:
     return EMAIL_SENT_DIR / f"{date_dir}_{shift}.sent"
 
 
+# نوافذ إرسال الإيميل بالدقائق من منتصف الليل: (start, end) شاملة
+_EMAIL_SEND_WINDOWS = {
+    "shift1": (14 * 60, 15 * 60),
+    "shift2": (21 * 60, 22 * 60),
+    "shift3": ( 5 * 60,  6 * 60),
+}
+
+
 def should_send_email(now, shift: str) -> bool:
     """نافذة الإرسال: التقرير يُرسل قبل ساعة من نهاية المناوبة.
 
@@ -5494,21 +6008,12 @@ def should_send_email(now, shift: str) -> bool:
     shift2 (13:00–22:00): يُرسل الساعة 21:00
     shift3 (21:00–06:00): يُرسل الساعة 05:00
     """
-    # (start_h, start_m, end_h, end_m)
-    windows = {
-        "shift1": (14, 0, 15, 0),
-        "shift2": (21, 0, 22, 0),
-        "shift3": (5,  0,  6, 0),
-    }
-    w = windows.get(shift)
+    w = _EMAIL_SEND_WINDOWS.get(shift)
     if not w:
         return False
 
     current = now.hour * 60 + now.minute
-    start_m = w[0] * 60 + w[1]
-    end_m   = w[2] * 60 + w[3]
-
-    return start_m <= current <= end_m
+    return w[0] <= current <= w[1]
 
 
 def maybe_send_email(now, date_dir: str, shift: str) -> None:
@@ -5538,24 +6043,23 @@ def _shift_window_for(ref_dt: datetime) -> tuple[datetime, datetime]:
       shift2 : 14:30 – 21:30 (أوفلود بعد 21:30 → shift3)
       shift3 : 21:30 – 05:30 (أوفلود بعد 05:30 → shift1)
     """
-    tz  = ZoneInfo(TIMEZONE)
+    tz  = LOCAL_TZ
     loc = ref_dt.astimezone(tz)
-    mins = loc.hour * 60 + loc.minute
+    shift = _shift_for_minutes(loc.hour * 60 + loc.minute)
 
     base = loc.replace(hour=0, minute=0, second=0, microsecond=0)
 
-    if 5 * 60 + 30 <= mins < 14 * 60 + 30:       # shift1
-        start = base.replace(hour=5, minute=30)
-        end   = base.replace(hour=14, minute=30)
-    elif 14 * 60 + 30 <= mins < 21 * 60 + 30:    # shift2
-        start = base.replace(hour=14, minute=30)
-        end   = base.replace(hour=21, minute=30)
+    if shift == "shift1":
+        start = base.replace(hour=_CUTOFF_SHIFT1[0], minute=_CUTOFF_SHIFT1[1])
+        end   = base.replace(hour=_CUTOFF_SHIFT2[0], minute=_CUTOFF_SHIFT2[1])
+    elif shift == "shift2":
+        start = base.replace(hour=_CUTOFF_SHIFT2[0], minute=_CUTOFF_SHIFT2[1])
+        end   = base.replace(hour=_CUTOFF_SHIFT3[0], minute=_CUTOFF_SHIFT3[1])
     else:                                          # shift3 يعبر منتصف الليل
         if loc.hour < 6:
             # بعد منتصف الليل — المناوبة بدأت أمس
-            start = (base - timedelta(days=1)).replace(hour=21, minute=30)
-        else:
-            start = base.replace(hour=21, minute=30)
+            base = base - timedelta(days=1)
+        start = base.replace(hour=_CUTOFF_SHIFT3[0], minute=_CUTOFF_SHIFT3[1])
         end = (start + timedelta(hours=8))
 
     return start, end
@@ -5571,7 +6075,7 @@ def filter_flights_by_shift(flights: list[dict], now: datetime) -> list[dict]:
     - إذا كان بدون تاريخ أو لم يُوزَّع → نُبقيه (لا نحذفه).
     """
     shift_start, shift_end = _shift_window_for(now)
-    tz = ZoneInfo(TIMEZONE)
+    tz = LOCAL_TZ
 
     kept    = []
     skipped = []
@@ -5609,6 +6113,13 @@ def filter_flights_by_shift(flights: list[dict], now: datetime) -> list[dict]:
     return kept
 
 
+def _item_awbs(flight: dict) -> set[str]:
+    """مجموعة أرقام AWB غير الفارغة في الرحلة (strip مرة واحدة لكل شحنة)."""
+    awbs = {(it.get("awb") or "").strip() for it in flight.get("items", [])}
+    awbs.discard("")
+    return awbs
+
+
 def filter_flights_already_in_other_shifts(flights: list[dict], now: datetime) -> list[dict]:
     """تمنع تكرار الرحلات بناءً على AWBs وليس فقط رقم الرحلة.
 
@@ -5625,25 +6136,13 @@ def filter_flights_already_in_other_shifts(flights: list[dict], now: datetime) -
     for shift in ("shift1", "shift2", "shift3"):
         if shift == current_shift:
             continue
-        shift_folder = DATA_DIR / date_dir / shift
-        if not shift_folder.exists():
-            continue
-        for p in shift_folder.glob("*.json"):
-            if p.name == "meta.json":
-                continue
+        for p in _flight_json_files(DATA_DIR / date_dir / shift):
             try:
-                flt_data = json.loads(p.read_text(encoding="utf-8"))
+                flt_data = read_json(p)
                 flt_name = (flt_data.get("flight") or "").strip().upper()
                 if not flt_name:
                     continue
-                awbs = {
-                    (it.get("awb") or "").strip()
-                    for it in flt_data.get("items", [])
-                    if (it.get("awb") or "").strip()
-                }
-                if flt_name not in existing_flights:
-                    existing_flights[flt_name] = set()
-                existing_flights[flt_name].update(awbs)
+                existing_flights.setdefault(flt_name, set()).update(_item_awbs(flt_data))
             except Exception:
                 continue
 
@@ -5658,11 +6157,7 @@ def filter_flights_already_in_other_shifts(flights: list[dict], now: datetime) -
             kept.append(f)
             continue
         # نفس رقم الرحلة موجود — تحقق من AWBs
-        new_awbs = {
-            (it.get("awb") or "").strip()
-            for it in f.get("items", [])
-            if (it.get("awb") or "").strip()
-        }
+        new_awbs = _item_awbs(f)
         existing_awbs = existing_flights[flt_name]
         if not new_awbs:
             # لا توجد AWBs → لا يمكن الحكم بالتكرار، نحتفظ بالرحلة
@@ -5680,7 +6175,7 @@ def filter_flights_already_in_other_shifts(flights: list[dict], now: datetime) -
     return kept
 
 def main() -> None:
-    now = datetime.now(ZoneInfo(TIMEZONE))
+    now = datetime.now(LOCAL_TZ)
     print(f"[{now.isoformat()}] Starting…")
 
     # ── وضع الإرسال الفوري (triggered من زر في الصفحة) ──
@@ -5698,6 +6193,7 @@ def main() -> None:
         if sent_file.exists():
             sent_file.unlink()
         send_shift_report_email(force_date, force_shift)
+        close_smtp_server()
         sent_file.write_text(now.isoformat(), encoding="utf-8")
         print("[force-send] Done. ✓")
         return
@@ -5714,7 +6210,7 @@ def main() -> None:
     if os.getenv("REBUILD_ALL", "").strip().lower() in ("1", "true", "yes", "y"):
         print("REBUILD_ALL=1 detected. Rebuilding ALL shift reports with latest template…")
         rebuilt = 0
-        for date_dir_p in sorted(p for p in DATA_DIR.iterdir() if p.is_dir()):
+        for date_dir_p in map(DATA_DIR.joinpath, _subdir_names(DATA_DIR)):
             for _s in ("shift1", "shift2", "shift3"):
                 if (date_dir_p / _s).exists():
                     build_shift_report(date_dir_p.name, _s)
@@ -5725,23 +6221,23 @@ def main() -> None:
         return
 
     print(f"Downloading file…")
-    html, file_modified_time = download_file()
-    new_hash = compute_sha256(html)
+    html, file_modified_time, new_hash = download_file()
 
     # تشخيص سريع
     print(f"HTML length: {len(html)}")
     print(f"HTML sha256: {new_hash[:16]}")
+    old_hash = STATE_FILE.read_text(encoding="utf-8").strip() if STATE_FILE.exists() else None
 
-    if STATE_FILE.exists():
-        old_hash = STATE_FILE.read_text(encoding="utf-8").strip()
+    if old_hash is not None:
         if old_hash == new_hash and not FORCE_REBUILD:
             print("No change detected — building NIL reports and root index…")
             build_root_index(now)
-            STATE_FILE.write_text(new_hash, encoding="utf-8")
+            _mark_processed(new_hash)
             # ── إرسال البريد قبل نهاية المناوبة (حتى لو لا يوجد تغيير) ──
             today_str = get_shift_date(now)
             for _shift in ("shift1", "shift2", "shift3"):
                 maybe_send_email(now, today_str, _shift)
+            close_smtp_server()
             return
         if old_hash == new_hash and FORCE_REBUILD:
             print("No change detected, but FORCE_REBUILD=1 → continuing to rebuild.")
@@ -5751,7 +6247,7 @@ def main() -> None:
 
     if not flights:
         print("WARNING: No flights extracted. Check HTML structure.")
-        STATE_FILE.write_text(new_hash, encoding="utf-8")
+        _mark_processed(new_hash)
         return
 
     # ── حفظ وقت تعديل الملف في كل رحلة لاستخدامه كوقت الإيميل ──
@@ -5765,7 +6261,7 @@ def main() -> None:
         try:
             _today = now.date()
             _h, _m = map(int, file_modified_time.split(":"))
-            email_dt = datetime(_today.year, _today.month, _today.day, _h, _m, tzinfo=ZoneInfo(TIMEZONE))
+            email_dt = datetime(_today.year, _today.month, _today.day, _h, _m, tzinfo=LOCAL_TZ)
             # إذا وقت الإيميل بعد منتصف الليل وقبل 06:00 والسكربت يشتغل بعد الظهر
             # فالتاريخ صحيح لأن الإيميل من نفس اليوم
             email_shift = get_shift(email_dt)
@@ -5779,7 +6275,7 @@ def main() -> None:
 
     if not flights:
         print("WARNING: All flights filtered out as old/stale — no data for this shift.")
-        STATE_FILE.write_text(new_hash, encoding="utf-8")
+        _mark_processed(new_hash)
         build_root_index(now)
         return
 
@@ -5821,7 +6317,7 @@ def main() -> None:
 
     if not flights:
         print("WARNING: All flights filtered out as duplicates from other shifts — no new flights for this shift.")
-        STATE_FILE.write_text(new_hash, encoding="utf-8")
+        _mark_processed(new_hash)
         build_root_index(now)
         return
 
@@ -5834,14 +6330,19 @@ def main() -> None:
         build_shift_report(report_date_dir, shift)
     build_root_index(now)
 
-    STATE_FILE.write_text(new_hash, encoding="utf-8")
+    _mark_processed(new_hash)
     print(f"Done. ✓  ({len(flights)} flights saved)")
 
     # ── إرسال البريد قبل نهاية المناوبة ──
     today_str = get_shift_date(now)
     for _shift in ("shift1", "shift2", "shift3"):
         maybe_send_email(now, today_str, _shift)
+    close_smtp_server()
 
 
 if __name__ == "__main__":
-    main()
+    try:
+        main()
+    finally:
+        # يغلق اتصال SMTP المشترك حتى لو خرج main() باستثناء أو return مبكر
+        close_smtp_server()
@@ -1,5 +1,6 @@
 import imaplib
 import email
+from email.parser import BytesHeaderParser
 from email.utils import parsedate_to_datetime
 from pathlib import Path
 from datetime import datetime
@@ -15,6 +16,12 @@ TARGET_FOLDER = "Offload Reports"
 BASE_DIR = Path("downloads")
 BASE_DIR.mkdir(exist_ok=True)
 
+# عدد الرسائل في كل أمر FETCH (رحلة واحدة للسيرفر بدل رحلة لكل رسالة)
+FETCH_BATCH_SIZE = 100
+
+# لمرحلة الـ Subject: يقرأ الـ headers فقط ولا يبني شجرة MIME
+HEADER_PARSER = BytesHeaderParser()
+
 
 def clean_name(text: str) -> str:
     text = (text or "").strip().lower()
@@ -38,18 +45,19 @@ def get_html_content(msg) -> str | None:
 
     if msg.is_multipart():
         for part in msg.walk():
-            content_type = part.get_content_type()
-            disposition = str(part.get("Content-Disposition") or "").lower()
+            # نفحص النوع أولاً: الحاويات والصور/PDF لا نقرأ لها أي شيء آخر
+            if part.get_content_type() != "text/html":
+                continue
 
+            disposition = str(part.get("Content-Disposition") or "").lower()
             if "attachment" in disposition:
                 continue
 
-            if content_type == "text/html":
-                payload = part.get_payload(decode=True)
-                if payload:
-                    html_content = payload.decode(errors="ignore")
-                    break
-    else:
+            payload = part.get_payload(decode=True)
+            if payload:
+                html_content = payload.decode(errors="ignore")
+                break
+    elif msg.get_content_maintype() == "text":
         payload = msg.get_payload(decode=True)
         if payload:
             html_content = payload.decode(errors="ignore")
@@ -83,6 +91,25 @@ def extract_folder_names(folders) -> list[str]:
     return names
 
 
+def fetch_messages(mail, ids: list[bytes], query: str = "(BODY.PEEK[])"):
+    """Fetch messages in batches and yield (num, raw_bytes) for each one.
+
+    BODY.PEEK[] returns the same bytes as RFC822 without setting \\Seen;
+    main() marks the fetched messages read afterwards with one STORE.
+    """
+    for start in range(0, len(ids), FETCH_BATCH_SIZE):
+        chunk = ids[start:start + FETCH_BATCH_SIZE]
+        status, msg_data = mail.fetch(b",".join(chunk), query)
+        if status != "OK":
+            print(f"[ERROR] Failed to fetch emails {chunk[0].decode()}..{chunk[-1].decode()}")
+            continue
+
+        # الرد: (b'12 (BODY[] {1234}', payload) لكل رسالة يتخللها b')'
+        for part in msg_data:
+            if isinstance(part, tuple):
+                yield part[0].split()[0], part[1]
+
+
 def main():
     mail = imaplib.IMAP4_SSL(IMAP_SERVER)
     mail.login(EMAIL, PASSWORD)
@@ -123,26 +150,28 @@ def main():
     if status != "OK":
         raise RuntimeError(f'Failed to search emails in folder "{actual_folder}"')
 
-    ids = messages[0].split()
-    print(f"[INFO] Search returned {len(ids)} email id(s)")
+    # نحتاج آخر 15 فقط — rsplit يقطع من النهاية بدل تقسيم كل المعرّفات ثم القص
+    raw_ids = messages[0].strip()
+    print(f"[INFO] Search returned {raw_ids.count(b' ') + 1 if raw_ids else 0} email id(s)")
 
-    ids = ids[-15:]
+    ids = raw_ids.rsplit(maxsplit=15)[-15:]
     saved_count = 0
 
-    for num in ids:
-        status, msg_data = mail.fetch(num, "(RFC822)")
-        if status != "OK":
-            print(f"[ERROR] Failed to fetch email {num.decode()}")
-            continue
-
-        msg = email.message_from_bytes(msg_data[0][1])
-
-        subject = msg.get("Subject", "offload")
+    # ── المرحلة 1: نجلب الـ Subject فقط ونستبعد غير الأوفلود قبل تنزيل الجسم ──
+    subjects: dict[bytes, str] = {}
+    for num, raw in fetch_messages(mail, ids, "(BODY.PEEK[HEADER.FIELDS (SUBJECT)])"):
+        subject = HEADER_PARSER.parsebytes(raw).get("Subject", "offload")
         print(f"\n[EMAIL] {subject}")
 
         if not is_offload_email(subject):
             print("[SKIP] Not an offload email")
             continue
+        subjects[num] = subject
+
+    # ── المرحلة 2: الرسالة الكاملة فقط لإيميلات الأوفلود ──
+    for num, raw in fetch_messages(mail, list(subjects)):
+        msg = email.message_from_bytes(raw)
+        subject = subjects[num]
 
         email_dt = get_email_datetime(msg)
         date_folder = email_dt.strftime("%Y-%m-%d")
@@ -167,10 +196,17 @@ def main():
             print(f"[SKIP] Already exists: {filename}")
             continue
 
-        file_path.write_text(html_content, encoding="utf-8")
+        # ترميز واحد ثم كتابة البايتات مباشرة (بدون TextIOWrapper)
+        file_path.write_bytes(html_content.encode("utf-8"))
         print(f"[SAVED HTML] {file_path}")
         saved_count += 1
 
+    # BODY.PEEK لا يضع \Seen — نعلّمها مقروءة دفعة واحدة كما كان يفعل جلب RFC822
+    if ids:
+        status, _ = mail.store(b",".join(ids), "+FLAGS", "\\Seen")
+        if status != "OK":
+            print("[WARN] Failed to mark fetched emails as read")
+
     print(f"\n[INFO] Saved {saved_count} offload HTML file(s)")
 
     mail.logout()
@@ -28,11 +28,21 @@ from pathlib import Path
 
 import requests
 import pandas as pd
+from urllib3.util.request import ACCEPT_ENCODING
+
+# orjson يكتب roster.json (بطاقات HTML لكل أيام الشهر) كبايتات مباشرة — نرجع لـ json إذا غير مثبّت
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 # ── إعدادات ──────────────────────────────────────────────────────────────────
 
 ROSTER_JSON_PATH = Path(os.getenv("ROSTER_JSON_PATH", "docs/data/roster.json"))
 STATE_FILE       = Path("roster_state.txt")
+# ETag / Last-Modified لآخر ملف إكسل تمت معالجته — بجانب roster_state.txt وتُحفظ معه في الريبو
+# (ليس داخل data/: كل ‎*.json هناك يُقرأ كملف رحلة)
+CACHE_FILE       = Path("roster_onedrive_cache.json")
 
 # أكواد المناوبات → فئة
 # MN / ME = Morning, AN / AE = Afternoon, NN / NE = Night
@@ -65,18 +75,54 @@ DEPT_SHEETS = {
 
 # ── تحميل الملف ──────────────────────────────────────────────────────────────
 
-def download_excel(url: str) -> bytes:
+# Session واحدة: رابط المشاركة يمر بعدة تحويلات (1drv.ms → onedrive → التحميل)
+# فيُعاد استخدام اتصالات TLS المفتوحة بدل مصافحة جديدة لكل طلب.
+_SESSION = requests.Session()
+_SESSION.headers["Accept-Encoding"] = ACCEPT_ENCODING  # br فقط إذا brotli مثبّتة
+
+def download_excel(url: str, cached: dict | None = None) -> tuple[bytes | None, dict]:
+    """Return (excel_bytes, validators). excel_bytes is None on 304 Not Modified.
+
+    cached holds the ETag / Last-Modified of the last processed download; they
+    are sent as If-None-Match / If-Modified-Since.
+    """
     url = url.strip()
     sep = "&" if "?" in url else "?"
     if "download=1" not in url:
         url += f"{sep}download=1"
     url += f"&__ts={int(datetime.now().timestamp())}"
-    r = requests.get(url, timeout=30, headers={
+    headers = {
         "Cache-Control": "no-cache, no-store, must-revalidate",
         "Pragma": "no-cache",
-    })
+    }
+    cached = cached or {}
+    if cached.get("etag"):
+        headers["If-None-Match"] = cached["etag"]
+    if cached.get("last_modified"):
+        headers["If-Modified-Since"] = cached["last_modified"]
+    r = _SESSION.get(url, timeout=30, headers=headers)
+    if r.status_code == 304:
+        return None, cached
     r.raise_for_status()
-    return r.content
+    validators = {
+        "etag":          r.headers.get("ETag", ""),
+        "last_modified": r.headers.get("Last-Modified", ""),
+    }
+    return r.content, validators
+
+
+def load_validators() -> dict:
+    try:
+        return json.loads(CACHE_FILE.read_text(encoding="utf-8"))
+    except Exception:
+        return {}
+
+
+def save_validators(validators: dict) -> None:
+    """تُحفظ فقط بعد نجاح المعالجة — حتى لا يُتخطّى ملف لم يُبنَ roster.json منه."""
+    if not any(validators.values()) or load_validators() == validators:
+        return
+    CACHE_FILE.write_text(json.dumps(validators, indent=2), encoding="utf-8")
 
 
 def sha256_bytes(b: bytes) -> str:
@@ -184,6 +230,8 @@ def parse_sheet(df: pd.DataFrame, dept_name: str, year: int, month: int) -> dict
 
 # ── بناء cards_html ───────────────────────────────────────────────────────────
 
+SHIFT_ORDER = ("Morning", "Afternoon", "Night", "Annual Leave", "Training", "Off Day")
+
 def build_cards_html(employees: list[dict]) -> str:
     """
     Build cards_html HTML string compatible with offload_monitor.py parser.
@@ -203,22 +251,21 @@ def build_cards_html(employees: list[dict]) -> str:
     for emp in employees:
         by_dept[emp["dept"]][emp["shift_label"]].append(emp)
 
-    html_parts = []
-    shift_order = ["Morning", "Afternoon", "Night", "Annual Leave", "Training", "Off Day"]
+    # قائمة واحدة لكل أجزاء الـ HTML ثم join مرة واحدة (بدل += المتداخل)
+    html_parts: list[str] = []
+    append = html_parts.append
 
     for dept, shifts in by_dept.items():
-        dept_html = f'<div class="deptCard"><div class="deptTitle">{dept}</div>'
-        for shift_label in shift_order:
+        append(f'<div class="deptCard"><div class="deptTitle">{dept}</div>')
+        for shift_label in SHIFT_ORDER:
             if shift_label not in shifts:
                 continue
-            shift_html = f'<div class="shiftCard"><div class="shiftLabel">{shift_label}</div>'
+            append(f'<div class="shiftCard"><div class="shiftLabel">{shift_label}</div>')
             for emp in shifts[shift_label]:
                 display = f'{emp["name"]} - {emp["sn"]}' if emp["sn"] else emp["name"]
-                shift_html += f'<div class="empRow"><span class="empName">{display}</span></div>'
-            shift_html += '</div>'
-            dept_html += shift_html
-        dept_html += '</div>'
-        html_parts.append(dept_html)
+                append(f'<div class="empRow"><span class="empName">{display}</span></div>')
+            append('</div>')
+        append('</div>')
 
     return "".join(html_parts)
 
@@ -264,22 +311,29 @@ def main():
         print("ERROR: ONEDRIVE_ROSTER_URL environment variable not set.")
         return
 
+    force = os.getenv("FORCE_REBUILD", "").strip().lower() in ("1", "true", "yes")
+
     print(f"[roster] Downloading Excel from OneDrive...")
     try:
-        excel_bytes = download_excel(roster_url)
+        # طلب مشروط: 304 بدون جسم إذا الإكسل لم يتغير منذ آخر معالجة
+        excel_bytes, validators = download_excel(roster_url, None if force else load_validators())
     except Exception as e:
         print(f"[roster] Download failed: {e}")
         return
 
+    if excel_bytes is None:
+        print("[roster] 304 Not Modified — skipping rebuild.")
+        return
+
     new_hash = sha256_bytes(excel_bytes)
     print(f"[roster] Excel size: {len(excel_bytes):,} bytes | sha256: {new_hash[:16]}")
 
     # Check if file changed
-    force = os.getenv("FORCE_REBUILD", "").strip().lower() in ("1", "true", "yes")
     if STATE_FILE.exists() and not force:
         old_hash = STATE_FILE.read_text(encoding="utf-8").strip()
         if old_hash == new_hash:
             print("[roster] No change in Excel file — skipping rebuild.")
+            save_validators(validators)
             return
 
     print("[roster] Change detected. Parsing sheets...")
@@ -342,11 +396,15 @@ def main():
 
     # Save
     ROSTER_JSON_PATH.parent.mkdir(parents=True, exist_ok=True)
-    ROSTER_JSON_PATH.write_text(
-        json.dumps(output, ensure_ascii=False, indent=2),
-        encoding="utf-8"
-    )
+    if orjson is not None:
+        ROSTER_JSON_PATH.write_bytes(orjson.dumps(output, option=orjson.OPT_INDENT_2))
+    else:
+        ROSTER_JSON_PATH.write_text(
+            json.dumps(output, ensure_ascii=False, indent=2),
+            encoding="utf-8"
+        )
     STATE_FILE.write_text(new_hash, encoding="utf-8")
+    save_validators(validators)
 
     total_days = len(days_json)
     print(f"[roster] ✓ Saved {total_days} days to {ROSTER_JSON_PATH}")
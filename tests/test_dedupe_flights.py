@@ -0,0 +1,62 @@
+"""_dedupe_flights: the same shipment repeated across blocks of one email is counted once."""
+import sys
+import unittest
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import offload_monitor as om
+
+
+def _item(awb="910 1234 5675", pcs="35", kgs="420", trolley="", reason=""):
+    return {
+        "awb": awb, "pcs": pcs, "kgs": kgs, "description": "GEN",
+        "reason": reason, "class_": "", "item": "", "trolley": trolley,
+    }
+
+
+def _flight(items, fmt="A"):
+    return {
+        "flight": "WY 101", "date": "01JAN", "std_etd": "", "destination": "LHR",
+        "format": fmt, "reason": "", "items": items,
+    }
+
+
+class DedupeFlightsTest(unittest.TestCase):
+    def test_identical_rows_are_counted_once(self):
+        out = om._dedupe_flights([_flight([_item()]), _flight([_item()])])
+        self.assertEqual(len(out), 1)
+        self.assertEqual(len(out[0]["items"]), 1)
+
+    def test_rows_differing_only_in_trolley_are_counted_once(self):
+        out = om._dedupe_flights([
+            _flight([_item()]),
+            _flight([_item(trolley="T12", reason="SPACE")]),
+        ])
+        items = out[0]["items"]
+        self.assertEqual(len(items), 1)
+        self.assertEqual(items[0]["pcs"], "35")
+        self.assertEqual(items[0]["trolley"], "T12")
+        self.assertEqual(items[0]["reason"], "SPACE")
+
+    def test_first_non_empty_trolley_is_kept(self):
+        out = om._dedupe_flights([
+            _flight([_item(trolley="T12")]),
+            _flight([_item()]),
+        ])
+        self.assertEqual(out[0]["items"][0]["trolley"], "T12")
+
+    def test_different_shipments_are_merged(self):
+        out = om._dedupe_flights([
+            _flight([_item()]),
+            _flight([_item(awb="910 1234 9999", pcs="5")]),
+        ])
+        self.assertEqual([i["awb"] for i in out[0]["items"]], ["910 1234 5675", "910 1234 9999"])
+
+    def test_repeat_from_another_format_is_skipped(self):
+        out = om._dedupe_flights([_flight([_item()]), _flight([_item(awb="x")], fmt="C")])
+        self.assertEqual(len(out[0]["items"]), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,40 @@
+"""Report email serialization: sendmail sends bytes unchanged, so they must already be CRLF."""
+import sys
+import unittest
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import offload_monitor as om
+
+
+def _wire() -> bytes:
+    html = "<html><body><table><tr><td>EK 123 — 35 pcs</td></tr></table></body></html>"
+    return om._build_email_wire(
+        "sender@example.com",
+        ["a@example.com", "b@example.com"],
+        "Export Warehouse Activity Report — 2026-01-01 | Morning Shift",
+        "2026-01-01",
+        "shift1",
+        html,
+    )
+
+
+class EmailWireTest(unittest.TestCase):
+    def test_lines_are_crlf_terminated(self):
+        wire = _wire()
+        self.assertIn(b"\r\n", wire)
+        bare = wire.replace(b"\r\n", b"")
+        self.assertNotIn(b"\n", bare)
+        self.assertNotIn(b"\r", bare)
+
+    def test_plain_and_html_parts_are_quoted_printable(self):
+        wire = _wire()
+        self.assertIn(b"Content-Type: multipart/alternative", wire)
+        self.assertIn(b"Content-Type: text/plain", wire)
+        self.assertIn(b"Content-Type: text/html", wire)
+        self.assertEqual(wire.count(b"Content-Transfer-Encoding: quoted-printable"), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,57 @@
+"""Response bodies reach the parser with the right charset: HTTP header, then <meta>, then UTF-8."""
+import sys
+import unittest
+from pathlib import Path
+
+import requests
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import offload_monitor as om
+
+# تصدير Outlook بترميز windows-1252: é و“ ” بايت واحد لكل منها
+CP1252_PAGE = (
+    '<html><head><meta http-equiv="Content-Type" content="text/html; charset=windows-1252"></head>'
+    "<body><p>OFFLOADED CARGO café “SPACE”</p></body></html>"
+).encode("cp1252")
+UTF8_PAGE = "<html><body><p>شحنة مؤجلة café</p></body></html>".encode("utf-8")
+
+
+def _response(body: bytes, content_type: str) -> requests.Response:
+    resp = requests.Response()
+    resp._content = body
+    resp.status_code = 200
+    if content_type:
+        resp.headers["Content-Type"] = content_type
+    resp.encoding = requests.utils.get_encoding_from_headers(resp.headers)
+    return resp
+
+
+def _text(body: bytes, content_type: str) -> str:
+    return om._html_page_text(om._response_html(_response(body, content_type)))
+
+
+class ResponseCharsetTest(unittest.TestCase):
+    def test_cp1252_meta_is_honoured_without_http_charset(self):
+        for ctype in ("application/octet-stream", "text/html", ""):
+            with self.subTest(content_type=ctype):
+                self.assertEqual(_text(CP1252_PAGE, ctype), "OFFLOADED CARGO café “SPACE”")
+
+    def test_undeclared_utf8_is_not_read_as_latin1(self):
+        for ctype in ("application/octet-stream", "text/html"):
+            with self.subTest(content_type=ctype):
+                self.assertEqual(_text(UTF8_PAGE, ctype), "شحنة مؤجلة café")
+
+    def test_http_charset_is_used(self):
+        self.assertEqual(_text(UTF8_PAGE, "text/html; charset=utf-8"), "شحنة مؤجلة café")
+        self.assertEqual(
+            _text(CP1252_PAGE, "text/html; charset=windows-1252"),
+            "OFFLOADED CARGO café “SPACE”",
+        )
+
+    def test_undeclared_body_is_passed_as_bytes(self):
+        self.assertIsInstance(om._response_html(_response(UTF8_PAGE, "text/html")), bytes)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,52 @@
+"""_get_smtp_server: a cached connection that fails its NOOP is replaced, not reused."""
+import smtplib
+import ssl
+import sys
+import unittest
+from pathlib import Path
+from unittest import mock
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import offload_monitor as om
+
+
+class SmtpReconnectTest(unittest.TestCase):
+    def setUp(self):
+        om._smtp_server = None
+
+    def tearDown(self):
+        om._smtp_server = None
+
+    def _reconnects_after(self, exc: Exception):
+        dead = mock.Mock()
+        dead.noop.side_effect = exc
+        om._smtp_server = dead
+        fresh = mock.Mock()
+        with mock.patch.object(smtplib, "SMTP_SSL", return_value=fresh) as smtp_ssl:
+            server = om._get_smtp_server("user", "pass")
+        self.assertIs(server, fresh)
+        self.assertIs(om._smtp_server, fresh)
+        smtp_ssl.assert_called_once()
+        fresh.login.assert_called_once_with("user", "pass")
+        dead.close.assert_called_once()
+
+    def test_reconnects_after_smtp_error(self):
+        self._reconnects_after(smtplib.SMTPServerDisconnected("gone"))
+
+    def test_reconnects_after_dropped_socket(self):
+        self._reconnects_after(ConnectionResetError("reset by peer"))
+
+    def test_reconnects_after_ssl_error(self):
+        self._reconnects_after(ssl.SSLError("bad record mac"))
+
+    def test_reuses_live_connection(self):
+        live = mock.Mock()
+        om._smtp_server = live
+        with mock.patch.object(smtplib, "SMTP_SSL") as smtp_ssl:
+            self.assertIs(om._get_smtp_server("user", "pass"), live)
+        smtp_ssl.assert_not_called()
+
+
+if __name__ == "__main__":
+    unittest.main()